@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+import time
+import argparse
+import numpy as np
+
+from plotter import config
+from plotter.plotter.plotter_base import BasePlotter
+from plotter.utils.gcode import *
+from plotter.utils.math import SimplePhysicsEngine
+
+
+def timeIt(func, repeat):
+    """Returns the result and the best runtime (seconds) of func over repeat runs."""
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def benchmarkGCode(args):
+    """Compares the bulk gcode parser and writer with the per command functions."""
+    with open(args.input, 'r') as f:
+        text = f.read()
+    lines = text.split("\n")
+    print("Benchmarking %d lines of %s" % (len(lines), args.input))
+
+    def decodeAll():
+        return [(l.split()[0], decodeGCode(l)) for l in lines if l.strip()]
+
+    def encodeAll():
+        gcode = []
+        for code, d in decoded:
+            if code == "G0":
+                gcode.append(GCode_goTo((d["X"], d["Y"]), d.get("S")))
+            elif code == "G2":
+                gcode.append(GCode_arc((d["X"], d["Y"]), d["R"],
+                                       d["A"], d["B"], d.get("S")))
+            else:
+                gcode.append(code)
+        return "\n".join(gcode)
+
+    decoded, tDecode = timeIt(decodeAll, args.repeat)
+    cmds, tParse = timeIt(lambda: parseGCode(text), args.repeat)
+    encoded, tEncode = timeIt(encodeAll, args.repeat)
+    formatted, tFormat = timeIt(lambda: formatGCode(cmds), args.repeat)
+
+    print("Read:  decodeGCode %10.0f lines/s, parseGCode  %10.0f lines/s (%.1fx)" %
+          (len(lines)/tDecode, len(lines)/tParse, tDecode/tParse))
+    print("Write: GCode_*     %10.0f lines/s, formatGCode %10.0f lines/s (%.1fx)" %
+          (len(lines)/tEncode, len(lines)/tFormat, tEncode/tFormat))
+    print("Output identical: %s" % (encoded == formatted))
+
+
+class NullPlotter(BasePlotter):
+    """Plotter which discards all items, to measure the transport to the worker process."""
+
+    def executeItem(self, item):
+        pass
+
+
+def benchmarkQueue(args):
+    """Compares the throughput of the worker queue with single and batched commands."""
+    cmds = [GCode_goTo((i % 500, i % 300)) for i in range(args.count)]
+    print("Sending %d commands to the plotter process" % args.count)
+
+    def run(batchSize, batched):
+        plotterConfig = dict(config.PLOTTER_CONFIG, queue_batch_size=batchSize)
+        plotter = NullPlotter(plotterConfig, np.array(
+            [plotterConfig["base_width"]]*2), SimplePhysicsEngine)
+        start = time.perf_counter()
+        for c in cmds:
+            if batched:
+                plotter.queueItem(c)
+            else:
+                plotter.workerQueue.put(c)
+        plotter.shutdown()
+        return args.count/(time.perf_counter() - start)
+
+    single = run(1, False)
+    print("Single commands:     %10.0f cmds/s" % single)
+    for batchSize in args.batch_sizes:
+        batched = run(batchSize, True)
+        print("Batches of %5d:    %10.0f cmds/s (%.1fx)" %
+              (batchSize, batched, batched/single))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='VPlotter benchmarks.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Number of runs per benchmark, the fastest run is reported.")
+    subparsers = parser.add_subparsers(help="Available benchmarks:")
+
+    subparser = subparsers.add_parser(
+        "gcode", help="Throughput of the gcode parser and writer.")
+    subparser.add_argument("--input", required=True,
+                           help="Gcode file, e.g. generated with gcode_gen.py.")
+    subparser.set_defaults(func=benchmarkGCode)
+
+    subparser = subparsers.add_parser(
+        "queue", help="Throughput of the queue to the plotter process.")
+    subparser.add_argument("--count", type=int, default=200000,
+                           help="Number of commands to send.")
+    subparser.add_argument("--batch-sizes", type=int, nargs="+", default=[16, 256, 1024],
+                           help="Batch sizes to compare with single commands.")
+    subparser.set_defaults(func=benchmarkQueue)
+
+    args = parser.parse_args()
+    args.func(args)
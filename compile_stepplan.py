@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+if __name__ == '__main__':
+    import numpy as np
+    import time
+    import argparse
+
+    from plotter import config
+    from plotter.plotter.plotter_steps import StepPlanCompiler
+    from plotter.utils.math import SimplePhysicsEngine
+
+    parser = argparse.ArgumentParser(
+        description='Compiles gcode into a step plan, which contains all stepper and servo moves of the hardware plotter. '
+        'Run this on a fast machine and execute the step plan on the plotter with "./plottermain.py --backend hw --runfile <plan>.vsp".',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--input', type=str, required=True,
+                        help="Gcode file or binary job file (.vpj).")
+    parser.add_argument('--output', type=str, required=True,
+                        help="Step plan file (.vsp).")
+    parser.add_argument('--calib', nargs=2, type=float, required=True,
+                        help="Length of left and right string in milimeters. Has to match the calibration of the plotter.")
+
+    args = parser.parse_args()
+    print(args)
+
+    start = time.time()
+    compiler = StepPlanCompiler(config.PLOTTER_CONFIG, np.array(args.calib),
+                                SimplePhysicsEngine, args.output)
+    if args.input.endswith(".vpj"):
+        compiler.compileJob(args.input)
+    else:
+        with open(args.input, 'r') as f:
+            compiler.compileGCode(f)
+    numRecords = compiler.close()
+
+    print("Compiled %d motor commands in %f s." % (numRecords, time.time() - start))
+    print(compiler.plannerReport())
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+
+if __name__ == '__main__':
+    import numpy as np
+    import time
+    import argparse
+
+    from plotter import config
+    from plotter.utils.estimator import estimateJob, formatEstimate
+    from plotter.utils.gcode import openJob, readGCodeFile
+    from plotter.utils.math import SimplePhysicsEngine
+
+    parser = argparse.ArgumentParser(
+        description='Estimates distances, pen lifts, steps and the time of a job on the hardware plotter without executing it. '
+        'Uses the kinematics, step rate, acceleration and servo settings of the plotter config.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--input', type=str, required=True, nargs="+",
+                        help="Gcode files or binary job files (.vpj). Multiple files are estimated one after another, e.g. to compare generator settings.")
+    parser.add_argument('--calib', nargs=2, type=float, required=True,
+                        help="Length of left and right string in milimeters.")
+
+    args = parser.parse_args()
+
+    for file_name in args.input:
+        start = time.time()
+        cmds = openJob(file_name) if file_name.endswith(".vpj") else readGCodeFile(file_name)
+        estimate = estimateJob(cmds, config.PLOTTER_CONFIG, np.array(args.calib),
+                               SimplePhysicsEngine)
+        print("%s (%d commands, estimated in %.2f s)" % (file_name, cmds.shape[0], time.time() - start))
+        print(formatEstimate(estimate))
@@ -6,10 +6,13 @@ import argparse
 
 from plotter import utils
 from plotter import plotter
+from plotter import config
 
-from plotter.utils.gcode import postProcessGCode
+from plotter.utils.gcode import postProcessGCode, writeGCode, writeJob
+from plotter.utils.toolpath import postProcessToolpath
+from plotter.utils.optimizer import optimizeStrokeOrder, joinStrokes
 
-from plotter.generators.generator_base import convertFileToGcode
+from plotter.generators.generator_base import convertFileToGcode, convertFileToToolpath
 
 from plotter.generators.arc_generator import ArcGenerator
 from plotter.generators.box_generator import BoxGenerator
@@ -32,19 +35,30 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='VPlotter gocde generator.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('--output', type=str,
-                        help="Output gcode filename", required=True)
+                        help="Output gcode filename. Files ending with .vpj are written as binary job files, which can be memory mapped by the plotter.", required=True)
     parser.add_argument(
         '--input', type=str, help="Input image filename. Downscale image to speedup process.")
     parser.add_argument('--scale', type=float, default=1.0,
                         help="Rescale the generated gcode.")
     parser.add_argument('--min-segment-length', type=float, default=1.0,
                         help="When postprocessing, segments shorter than this value (in mm) will get removed.")
+    parser.add_argument('--simplify', type=float, default=0.0,
+                        help="When postprocessing, simplify lines with the Ramer-Douglas-Peucker algorithm. Removed points deviate less than this value (in mm) from the result. 0 disables simplification.")
     parser.add_argument('--offset', nargs=2, type=float,
                         default=[0, 0], help="Shift generated gcode by offset (x,y).")
     parser.add_argument('--speed-nodraw', type=float, default=300000,
                         help="Speed when printhead is not drawing.")
     parser.add_argument('--speed-draw', type=float,
                         default=50000, help="Speed when printhead is drawing.")
+    parser.add_argument('--toolpath', action='store_true',
+                        help="Process the job as compact toolpath arrays instead of a stream of commands. The whole job is kept in memory.")
+    parser.add_argument('--optimize-order', action='store_true',
+                        help="Reorder and reverse strokes to minimize the pen-up travel distance. Implies --toolpath.")
+    parser.add_argument('--optimize-time', type=float, default=10.0,
+                        help="Max. time in seconds for improving the stroke order after the initial nearest neighbor ordering.")
+
+    parser.add_argument('--join-strokes', type=float, default=0.0,
+                        help="Join drawing strokes whose endpoints are at most this distance (in mm) apart, to avoid pen lifts. 0 disables joining, otherwise implies --toolpath.")
 
     subparsers = parser.add_subparsers(help="Available Generators:")
     for g in generators:
@@ -59,15 +73,40 @@ if __name__ == '__main__':
     args = parser.parse_args()
     print(args)
 
-    print("Generating gcode...")
     gen = generators[args.generator](vars(args))
 
-    gcode = convertFileToGcode(args.input, gen)
+    if args.toolpath or args.optimize_order or args.join_strokes > 0:
+        print("Generating toolpath...")
+        toolpath = convertFileToToolpath(args.input, gen)
+
+        print("Postprocessing toolpath...")
+        toolpath = postProcessToolpath(
+            toolpath, minSegmentLen=args.min_segment_length, simplifyTolerance=args.simplify)
+
+        if args.join_strokes > 0:
+            print("Joining strokes...")
+            toolpath = joinStrokes(
+                toolpath, args.join_strokes, args.speed_nodraw,
+                config.PLOTTER_CONFIG["servo_settle_up"] + config.PLOTTER_CONFIG["servo_settle_down"])
+
+        if args.optimize_order:
+            print("Optimizing stroke order...")
+            toolpath = optimizeStrokeOrder(
+                toolpath, args.speed_nodraw, timeLimit=args.optimize_time)
 
-    print("Postprocessing gcode...")
-    gcode = postProcessGCode(gcode, minSegmentLen=args.min_segment_length)
+        # Gcode is only rendered when writing the file
+        gcode = toolpath.iterGCode()
+    else:
+        # All stages are chained lazily, commands are generated,
+        # postprocessed and written in small chunks
+        gcode = convertFileToGcode(args.input, gen)
+        gcode = postProcessGCode(
+            gcode, minSegmentLen=args.min_segment_length, simplifyTolerance=args.simplify)
 
-    print("Saving gcode...")
-    with open(args.output, 'w') as the_file:
-        the_file.write("\n".join(gcode))
+    if args.output.endswith(".vpj"):
+        print("Saving binary job...")
+        writeJob(gcode, args.output)
+    else:
+        print("Saving gcode...")
+        writeGCode(gcode, args.output)
     print("Done.")
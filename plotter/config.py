@@ -12,6 +12,20 @@ PLOTTER_CONFIG = {
     "micro_stepping": 16,
     # Steps per milimeter for stepper motors.
     "steps_per_mm": 80,
+    # Max. acceleration of each stepper motor in mm/s^2
+    "max_acceleration": (500, 500),
+    # Max. instantaneous speed change of each stepper motor in mm/s,
+    # limits the speed at corners and when starting or stopping
+    "max_speed_jump": (5, 5),
+    # Number of stepper moves the motion planner looks ahead
+    "planner_lookahead": 32,
+    # Max. number of steps with constant speed while accelerating or decelerating
+    "planner_ramp_steps": 16,
+
+    # GPIO driver of the hardware plotter: "rpi" (RPi.GPIO) or "mock" (no hardware, records all outputs)
+    "gpio_driver": "rpi",
+    # File (.npy) to save the outputs recorded by the "mock" driver to, None to disable
+    "gpio_record_file": None,
 
     # Servo configuration
     # The servo is controlled by GPIO.PWM with a frequency of 50 Hz
@@ -23,6 +37,13 @@ PLOTTER_CONFIG = {
     "servo_pos_up": 8.7,
     # Down position for servo (duty cycle in percent)
     "servo_pos_down": 7.5,
+    # Time in seconds the servo requires to lift the pen
+    "servo_settle_up": 0.3,
+    # Time in seconds the servo requires to lower the pen
+    "servo_settle_down": 0.3,
+    # Time in seconds after lifting the pen until travel moves may start,
+    # the rest of the settle time overlaps with the travel move
+    "servo_travel_delay": 0.1,
 
     # Additional Hardware configuration
     # Width of your plotter. Distance between left and right timing belt mount
@@ -30,6 +51,18 @@ PLOTTER_CONFIG = {
 
     # Drawing configuration
     # Sampling resolution for step computation in mm, higher values decrease computational load but might also decrease quality
-    "movement_resolution": 1.0
+    "movement_resolution": 1.0,
+    # Max. deviation of the pen from the ideal path in mm (hardware plotter). Moves are split adaptively,
+    # the steppers interpolate the cord lengths linearly between two splits
+    "movement_tolerance": 0.1,
+
+    # Transport to the plotter process
+    # Number of commands which are sent to the plotter process at once
+    "queue_batch_size": 256,
+    # Max. time in seconds a command waits for its batch to be filled
+    "queue_batch_latency": 0.05,
+    # Number of stepper/servo moves buffered for the motor control process
+    "step_buffer_size": 1024
+
 
 }
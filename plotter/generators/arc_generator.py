@@ -33,6 +33,29 @@ class ArcGenerator(generator_base.GeneratorBase):
                                1, 2, 3, 4], help="List of directions that should be used for drawing")
         subparser.add_argument('--arc_sampling', default=20,
                                type=int, help="Number of samples per arc.")
+        subparser.add_argument('--native-arcs', default=False, action="store_true",
+                               help="Emit a single G2 command per drawn arc instead of sampled G0 moves.")
+
+    def arcTable(self, maxRadius):
+        """Precomputes the samples of all quarter arcs with radius 1 to maxRadius-1.
+        The samples of each arc are followed by one invalid sample, which separates
+        consecutive arcs. Returns radius, angle (degrees) and validity of each sample."""
+        radii = np.arange(1, maxRadius)
+
+        # Sample in such a way that each arc segment has the same length
+        # arc_length = 2*pi*r*radians/(2*pi)
+        # radians = arc_length/r
+        sampling = self.params["arc_sampling"]/radii
+        counts = np.ceil(90/sampling).astype(int)
+
+        blockLen = counts + 1
+        blockStart = np.cumsum(blockLen) - blockLen
+        idx = np.arange(np.sum(blockLen)) - np.repeat(blockStart, blockLen)
+
+        r = np.repeat(radii, blockLen)
+        angles = idx*np.repeat(sampling, blockLen)
+        valid = idx < np.repeat(counts, blockLen)
+        return r, angles, valid
 
     @overrides(generator_base.GeneratorBase)
     def convert(self, img):
@@ -40,79 +63,70 @@ class ArcGenerator(generator_base.GeneratorBase):
         if len(img.shape) == 3 and img.shape[2] > 1:
             img = img.mean(axis=2)
 
-        gcode = [GCode_up(), GCode_home()]
+        yield [GCode_up(), GCode_home()]
 
-        max_val = self.params["img_threshold_max"]
-        min_val = self.params["img_threshold_min"]
+        h, w = img.shape[:2]
         maxRadius = int(np.linalg.norm(img.shape))
 
+        # The trig tables are computed for the first quadrant only,
+        # all other directions are reflections of it.
+        r, angles, valid = self.arcTable(maxRadius)
+        sinTable = r*np.sin(np.radians(angles))
+        cosTable = r*np.cos(np.radians(angles))
+
         dirs_drawn = 0
         for d in self.params["dirs"]:
-            pImg = np.array([0, 0])
-            pScreen = self.px2Scr(pImg)
-
+            # Arc center and the gcode angle (from x towards y axis)
+            # of the table angle 0 and its direction.
             if d == 1:
-                offset = np.array([0, 0])
+                x, y = sinTable, cosTable
+                center, angleBase, angleDir = (0, 0), 90, -1
             elif d == 2:
-                offset = np.array([img.shape[1]-1, 0])
+                x, y = w - 1 - sinTable, cosTable
+                center, angleBase, angleDir = (w - 1, 0), 90, 1
             elif d == 3:
-                offset = np.array([0, img.shape[0]-1])
+                x, y = cosTable, h - 1 - sinTable
+                center, angleBase, angleDir = (0, h - 1), 0, -1
             elif d == 4:
-                offset = np.array([img.shape[1]-1, img.shape[0]-1])
-
-            for r in range(1, maxRadius):
+                x, y = w - 1 - cosTable, h - 1 - sinTable
+                center, angleBase, angleDir = (w - 1, h - 1), 180, 1
+            cScreen = self.px2Scr(np.array(center))
+
+            mask = generator_base.thresholdImage(img,
+                                                 self.params["img_threshold_min"],
+                                                 self.params["img_threshold_max"],
+                                                 self.params["img_threshold_inv"],
+                                                 dirs_drawn)
+
+            inside = valid & (x >= -0.5) & (y >= -0.5) & \
+                (x < w - 0.5) & (y < h - 0.5)
+            xi = np.where(inside, x, 0).astype(int)
+            yi = np.where(inside, y, 0).astype(int)
+            on = inside & mask[yi, xi]
+
+            # Every run of drawn samples on an arc is drawn as one stroke.
+            # Runs never cross arcs because of the invalid separator samples.
+            _, starts, ends = generator_base.findRuns(on[None, :])
+
+            for s, e in zip(starts, ends):
+                if self.params["native_arcs"]:
+                    pScreen = self.px2Scr(np.array([[x[s], y[s]]]))
+                else:
+                    pScreen = self.px2Scr(
+                        np.stack((x[s:e+1], y[s:e+1]), axis=1))
+
+                gcode = [GCode_goTo(pScreen[0], self.params["speed_nodraw"]),
+                         GCode_down()]
+
+                if self.params["native_arcs"]:
+                    gcode.append(GCode_arc(cScreen, r[s]*self.params["scale"],
+                                           angleBase + angleDir*angles[s],
+                                           angleBase + angleDir*angles[e],
+                                           self.params["speed_draw"]))
+                else:
+                    for p in pScreen[1:]:
+                        gcode.append(GCode_goTo(p, self.params["speed_draw"]))
                 gcode.append(GCode_up())
-                drawing = False
-                lastDrawPos = [0, 0]
-
-                # Sample in such a way that each arc segment has the same length
-                # arc_length = 2*pi*r*radians/(2*pi)
-                # radians = arc_length/r
-                sampling = self.params["arc_sampling"]/r
-                # print(sampling)
-
-                if d == 1:
-                    angles = np.arange(0, 90, sampling)
-                elif d == 2:
-                    angles = np.arange(0, -90, -sampling)
-                elif d == 3:
-                    angles = np.arange(90, 180, sampling)
-                elif d == 4:
-                    angles = np.arange(-90, -180, -sampling)
-
-                for a in angles:
-                    pImg = np.array(
-                        [r*np.sin(np.radians(a)), r*np.cos(np.radians(a))])
-                    pImg = pImg + offset
-
-                    if pImg[0] < -0.5 or pImg[1] < -0.5 or pImg[1] >= img.shape[0]-0.5 or pImg[0] >= img.shape[1]-0.5:
-                        continue
-
-                    pixel = img[int(pImg[1]), int(pImg[0])]
-
-                    if self.params["img_threshold_inv"]:
-                        pixel = 255 - pixel
-
-                    if pixel >= min_val and pixel <= max_val and pixel - min_val <= float(max_val - min_val)/(dirs_drawn+1):
-                        pScreen = self.px2Scr(pImg)
-                        gcode.append(GCode_goTo(
-                            pScreen, self.params["speed_nodraw"]))
-
-                        if not drawing:
-                            gcode.append(GCode_down())
-                            drawing = True
-
-                    else:
-                        if drawing:
-                            pScreen = self.px2Scr(lastDrawPos)
-                            gcode.append(GCode_goTo(
-                                pScreen, self.params["speed_draw"]))
-                            gcode.append(GCode_up())
-                            drawing = False
-
-                    if drawing:
-                        lastDrawPos = pImg
+                yield gcode
 
             dirs_drawn = dirs_drawn + 1
-
-        return gcode
@@ -53,7 +53,7 @@ class BoxGenerator(generator_base.GeneratorBase):
         if len(img.shape) == 3 and img.shape[2] > 1:
             img = img.mean(axis=2)
 
-        gcode = [GCode_up(), GCode_home()]
+        yield [GCode_up(), GCode_home()]
 
         lastY = 0
 
@@ -63,6 +63,4 @@ class BoxGenerator(generator_base.GeneratorBase):
         for index, pixel in np.ndenumerate(img):
             if pixel > 0:
                 y, x = index
-                gcode.extend(self.drawBox(np.array([x, y]), pixel/255.0))
-
-        return gcode
+                yield self.drawBox(np.array([x, y]), pixel/255.0)
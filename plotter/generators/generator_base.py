@@ -2,6 +2,9 @@ import numpy as np
 import imageio
 from svgpathtools import svg2paths
 
+from plotter.utils.gcode import iterCommands
+from plotter.utils.toolpath import Toolpath
+
 
 class GeneratorBase:
     """Generator base implementation."""
@@ -33,25 +36,61 @@ class GeneratorBase:
         self.params.update(params)
 
     def convert(self, input):
-        """Actually convert an input (image or (svg-path, attributes)) into a code file."""
+        """Actually convert an input (image or (svg-path, attributes)) into gcode.
+        Implemented as generator, which yields single commands or lists of commands."""
         return
 
+    def convertToolpath(self, input):
+        """Convert an input into a toolpath. The default implementation parses
+        the gcode of 'convert'. Override this to build the toolpath arrays directly."""
+        return Toolpath.fromGCode(iterCommands(self.convert(input)))
+
     def px2Scr(self, p):
         """Transform a point from pixel coordinates to actual drawing coordinates."""
         return p*self.params["scale"] + self.params["offset"]
 
 
-def convertFileToGcode(input_file_name, generator):
-    """Converts an input into gcode"""
+def thresholdImage(img, min_val, max_val, invert=False, layer=0):
+    """Returns a boolean mask of all pixels that should be drawn.
+    With every additional drawing layer (e.g. direction), the accepted value
+    range shrinks so darker pixels get drawn more often."""
+    pixels = img.astype(np.float64)
+    if invert:
+        pixels = 255 - pixels
+
+    return (pixels >= min_val) & (pixels <= max_val) & \
+        (pixels - min_val <= float(max_val - min_val)/(layer+1))
+
+
+def findRuns(mask):
+    """Finds all runs of consecutive True values in each row of a 2D mask.
+    Returns the row index, the first and the last column of every run,
+    ordered by row and column."""
+    padded = np.zeros((mask.shape[0], mask.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    return rows, starts, ends - 1
 
+
+def readInput(input_file_name, generator):
+    """Reads the input file for a generator."""
     if generator.getInputType() == "image":
-        im = imageio.imread(input_file_name)
-        gcode = generator.convert(im)
+        return imageio.imread(input_file_name)
     elif generator.getInputType() == "svg":
-        paths, attributes = svg2paths(input_file_name)
-        gcode = generator.convert((paths, attributes))
+        return svg2paths(input_file_name)
     else:
         raise ValueError("Invalid generator input type: " +
                          generator.getInputType())
 
-    return gcode
+
+def convertFileToGcode(input_file_name, generator):
+    """Converts an input into gcode. Returns an iterator over all commands,
+    which are generated while iterating."""
+    return iterCommands(generator.convert(readInput(input_file_name, generator)))
+
+
+def convertFileToToolpath(input_file_name, generator):
+    """Converts an input into a toolpath."""
+    return generator.convertToolpath(readInput(input_file_name, generator))
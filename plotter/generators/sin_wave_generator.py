@@ -31,7 +31,8 @@ class SinWaveGenerator(generator_base.GeneratorBase):
         if len(img.shape) == 3 and img.shape[2] > 1:
             img = img.mean(axis=2)
 
-        gcode = [GCode_up(), GCode_home()]
+        yield GCode_up()
+        yield GCode_home()
 
         lastY = 0
 
@@ -45,12 +46,10 @@ class SinWaveGenerator(generator_base.GeneratorBase):
             pScreen = self.px2Scr(pImg)
 
             if y != lastY:
-                gcode.append(GCode_up())
+                yield GCode_up()
 
-            gcode.append(GCode_goTo(pScreen))
+            yield GCode_goTo(pScreen)
 
             if y != lastY:
-                gcode.append(GCode_down())
+                yield GCode_down()
                 lastY = y
-
-        return gcode
@@ -3,6 +3,7 @@ import numpy as np
 from . import generator_base
 from plotter.utils.gcode import *
 from plotter.utils.helper import overrides
+from plotter.utils.toolpath import Toolpath
 
 
 class StraightLineGenerator(generator_base.GeneratorBase):
@@ -32,101 +33,92 @@ class StraightLineGenerator(generator_base.GeneratorBase):
         subparser.add_argument('--dirs', default=[1], nargs="*", type=int, choices=[
                                1, 2, 3, 4], help="List of directions that should be used for drawing")
 
-    @overrides(generator_base.GeneratorBase)
-    def convert(self, img):
-
+    def scanLines(self, shape, d):
+        """Returns the pixel coordinates (ys, xs) of all scan lines of direction d.
+        Both arrays have the shape (number of lines, max. line length), the
+        returned mask marks the entries that are part of the image."""
+        h, w = shape
+
+        if d == 1:
+            # Rows, left to right
+            y0, x0 = np.arange(h), np.zeros(h, dtype=int)
+            dy, dx = 0, 1
+            n = np.full(h, w)
+        elif d == 2:
+            # Columns, top to bottom
+            y0, x0 = np.zeros(w, dtype=int), np.arange(w)
+            dy, dx = 1, 0
+            n = np.full(w, h)
+        elif d == 3:
+            # Diagonals from bottom left to top right.
+            # Starting on the left border, then on the bottom border.
+            y0 = np.minimum(np.arange(h + w - 1), h - 1)
+            x0 = np.arange(h + w - 1) - y0
+            dy, dx = -1, 1
+            n = np.minimum(y0, w - 1 - x0) + 1
+        elif d == 4:
+            # Diagonals from top left to bottom right.
+            # Starting on the left border, then on the top border.
+            y0 = np.concatenate((np.arange(h), np.zeros(w - 1, dtype=int)))
+            x0 = np.concatenate((np.zeros(h, dtype=int), np.arange(1, w)))
+            dy, dx = 1, 1
+            n = np.minimum(h - y0, w - x0)
+
+        t = np.arange(n.max(), dtype=np.int32)
+        valid = t < n[:, None]
+        ys = np.where(valid, y0[:, None] + dy*t, 0).astype(np.int32)
+        xs = np.where(valid, x0[:, None] + dx*t, 0).astype(np.int32)
+        return ys, xs, valid
+
+    def strokes(self, img):
+        """Computes all strokes, direction by direction.
+        Yields the start and end points (in drawing coordinates) of each stroke."""
         if len(img.shape) == 3 and img.shape[2] > 1:
             img = img.mean(axis=2)
 
-        gcode = [GCode_up(), GCode_home()]
-
-        max_val = self.params["img_threshold_max"]
-        min_val = self.params["img_threshold_min"]
-
-        # Get pixel value and coordinates
-        pixels = np.reshape(np.array(list(np.ndenumerate(img))), [
-                            img.shape[0], img.shape[1], 2])
-
         dirs_drawn = 0
         for d in self.params["dirs"]:
-            indices = None
-
-            if d == 1:
-                indices = np.reshape(pixels, [-1, 2], order='C')
-            elif d == 2:
-                # Flip columns and rows
-                indices = np.reshape(pixels, [-1, 2], order='F')
-            elif d == 3:
-                indices = []
-                for y in range(img.shape[0]):
-                    for x in range(np.min([y, img.shape[1]-1])):
-                        indices.append(pixels[y-x, x, :])
-
-                for x in range(1, img.shape[1]):
-                    for y in range(img.shape[1] - x):
-                        indices.append(pixels[img.shape[0]-1-y, x+y, :])
-
-            elif d == 4:
-                indices = []
-                for y in range(img.shape[0]):
-                    for x in range(np.min([img.shape[1]-y, img.shape[1]-1])):
-                        indices.append(pixels[y+x, x, :])
-
-                for x in range(1, img.shape[1]):
-                    for y in range(np.min([img.shape[1]-x, img.shape[1]-1])):
-                        indices.append(pixels[y, x+y, :])
-
-            drawing = False
-            lastDrawPos = [0, 0]
-            lastY = 0
-            lastX = 0
-
-            for index, pixel in indices:
-                y, x = index
-
-                sameLine = False
-                # Change in x or y > 1 or not ?
-                if np.abs(x - lastX) <= 1 and np.abs(y - lastY) <= 1:
-                    sameLine = True
-
-                if not sameLine and drawing:
-                    pScreen = self.px2Scr(lastDrawPos)
-                    gcode.append(GCode_goTo(
-                        pScreen, self.params["speed_draw"]))
-                    gcode.append(GCode_up())
-                    drawing = False
-
-                lastY = y
-                lastX = x
-
-                pImg = np.array([x, y])
-
-                if self.params["img_threshold_inv"]:
-                    pixel = 255 - pixel
-
-                if pixel >= min_val and pixel <= max_val and pixel - min_val <= float(max_val - min_val)/(dirs_drawn+1):
-                    if not drawing:
-                        pScreen = self.px2Scr(pImg)
-                        gcode.append(GCode_goTo(
-                            pScreen, self.params["speed_nodraw"]))
-                        gcode.append(GCode_down())
-                        drawing = True
-                else:
-                    if drawing:
-                        pScreen = self.px2Scr(lastDrawPos)
-                        gcode.append(GCode_goTo(
-                            pScreen, self.params["speed_draw"]))
-                        gcode.append(GCode_up())
-                        drawing = False
-
-                if drawing:
-                    lastDrawPos = pImg
-
-            if drawing:
-                pScreen = self.px2Scr(lastDrawPos)
-                gcode.append(GCode_goTo(pScreen, self.params["speed_draw"]))
-                gcode.append(GCode_up())
+            mask = generator_base.thresholdImage(img,
+                                                 self.params["img_threshold_min"],
+                                                 self.params["img_threshold_max"],
+                                                 self.params["img_threshold_inv"],
+                                                 dirs_drawn)
+
+            # Draw a stroke for every run of pixels on a scan line
+            ys, xs, valid = self.scanLines(img.shape[:2], d)
+            lines, starts, ends = generator_base.findRuns(mask[ys, xs] & valid)
+
+            pStart = self.px2Scr(np.stack(
+                (xs[lines, starts], ys[lines, starts]), axis=1))
+            pEnd = self.px2Scr(np.stack(
+                (xs[lines, ends], ys[lines, ends]), axis=1))
+            yield pStart, pEnd
 
             dirs_drawn = dirs_drawn + 1
 
-        return gcode
+    @overrides(generator_base.GeneratorBase)
+    def convert(self, img):
+        yield [GCode_up(), GCode_home()]
+
+        for pStart, pEnd in self.strokes(img):
+            for s, e in zip(pStart, pEnd):
+                yield [GCode_goTo(s, self.params["speed_nodraw"]),
+                       GCode_down(),
+                       GCode_goTo(e, self.params["speed_draw"]),
+                       GCode_up()]
+
+    @overrides(generator_base.GeneratorBase)
+    def convertToolpath(self, img):
+        toolpaths = []
+        for pStart, pEnd in self.strokes(img):
+            # Each run becomes a travel stroke to its start point
+            # followed by a drawing stroke from start to end.
+            n = pStart.shape[0]
+            coords = np.stack((pStart, pStart, pEnd), axis=1)
+            offsets = np.concatenate(([0], np.cumsum(np.tile([1, 2], n))))
+            penDown = np.tile([False, True], n)
+            speed = np.tile([self.params["speed_nodraw"],
+                             self.params["speed_draw"]], n)
+            toolpaths.append(Toolpath(coords, offsets, penDown, speed))
+
+        return Toolpath.concatenate(toolpaths)
@@ -1,4 +1,5 @@
 import numpy as np
+from svgpathtools import Line, QuadraticBezier, CubicBezier, Arc
 
 from . import generator_base
 from plotter.utils.gcode import *
@@ -26,15 +27,47 @@ class SVGGenerator(generator_base.GeneratorBase):
 
     @classmethod
     def setupCustomParams(cls, subparser):
+        subparser.add_argument('--max-error', default=0.1, type=float,
+                               help="Max. deviation (in mm) of the drawn lines from curved path segments. Curves are sampled based on their length and curvature, straight lines only by their end points. Set to 0 to use a fixed sampling per path.")
         subparser.add_argument('--path-sampling', default=30, type=int,
-                               help="Number of samples taken from each path object. High number increases precision but also print time.")
+                               help="Number of samples taken from each path object if --max-error is 0. High number increases precision but also print time.")
+
+    def sampleSegment(self, seg, maxError):
+        """Samples a path segment in such a way that the polyline deviates at most
+        maxError from it. Returns the sampled points as complex values, excluding
+        the start point of the segment."""
+        if isinstance(seg, Line):
+            return np.array([seg.end])
+
+        # Upper bound of the second derivative with respect to t.
+        # A polyline with n equidistant samples in t deviates at most
+        # max|p''(t)|/(8*n^2) from the segment.
+        if isinstance(seg, QuadraticBezier):
+            maxCurv = 2*abs(seg.start - 2*seg.control + seg.end)
+        elif isinstance(seg, CubicBezier):
+            maxCurv = 6*max(abs(seg.start - 2*seg.control1 + seg.control2),
+                            abs(seg.control1 - 2*seg.control2 + seg.end))
+        elif isinstance(seg, Arc):
+            radius = max(abs(seg.radius.real), abs(seg.radius.imag))
+            maxCurv = radius*np.radians(seg.delta)**2
+        else:
+            raise ValueError("Unsupported path segment: " + type(seg).__name__)
+
+        n = max(int(np.ceil(np.sqrt(maxCurv/(8*maxError)))), 1)
+        t = np.linspace(0.0, 1.0, n + 1)[1:]
+
+        if isinstance(seg, Arc):
+            points = seg.point(t)
+        else:
+            points = seg.poly()(t)
+        points[-1] = seg.end
+        return points
 
     @overrides(generator_base.GeneratorBase)
     def convert(self, svg):
-        gcode = [GCode_up(), GCode_home()]
+        yield [GCode_up(), GCode_home()]
         paths, attr = svg
 
-        samplePoints = np.linspace(0.0, 1.0, self.params["path_sampling"])
         for p in paths:
 
             if p.iscontinuous():
@@ -42,17 +75,31 @@ class SVGGenerator(generator_base.GeneratorBase):
             else:
                 subpaths = p.continuous_subpaths()
             for s in subpaths:
+                if self.params["max_error"] > 0:
+                    points = self.sampleAdaptive(s)
+                else:
+                    points = self.sampleFixed(s)
+
                 # Points are represented as complex values
-                c = s.point(samplePoints[0])
-                x, y = np.real(c), np.imag(c)
-                c = self.px2Scr(np.array([x, y]))
-                gcode.append(GCode_goTo(c, self.params["speed_nodraw"]))
-                gcode.append(GCode_down())
-                for i in samplePoints[1:]:
-                    c = s.point(i)
-                    x, y = np.real(c), np.imag(c)
-                    c = self.px2Scr(np.array([x, y]))
+                points = self.px2Scr(
+                    np.stack((np.real(points), np.imag(points)), axis=1))
+
+                gcode = [GCode_goTo(points[0], self.params["speed_nodraw"]),
+                         GCode_down()]
+                for c in points[1:]:
                     gcode.append(GCode_goTo(c, self.params["speed_draw"]))
                 gcode.append(GCode_up())
+                yield gcode
+
+    def sampleFixed(self, path):
+        """Samples a continuous path at a fixed number of points."""
+        samplePoints = np.linspace(0.0, 1.0, self.params["path_sampling"])
+        return np.array([path.point(i) for i in samplePoints])
+
+    def sampleAdaptive(self, path):
+        """Samples a continuous path with a max. error per segment."""
+        # The error is specified on paper, convert to svg units
+        maxError = self.params["max_error"]/self.params["scale"]
 
-        return gcode
+        return np.concatenate([[path.start]] +
+                              [self.sampleSegment(seg, maxError) for seg in path])
@@ -0,0 +1,139 @@
+import time
+import importlib.util
+import numpy as np
+
+
+# Event recorded by the GPIO mock.
+# value: Output level (0 or 1) or duty cycle of a PWM pin (percent)
+GPIO_EVENT_DTYPE = np.dtype([("time", np.float64),
+                             ("pin", np.int32),
+                             ("value", np.float64)])
+
+
+class GPIODriver:
+    """Interface of the GPIO pins used by the motor controllers.
+    Pins are numbered by their BCM channel."""
+
+    def setup(self, pins):
+        """Configures a pin or a list of pins as output.
+        Raises an error if not implemented by derived class."""
+        raise NotImplementedError("Function setup not implemented")
+
+    def output(self, pins, values):
+        """Sets a pin or a list of pins to a single value or a list of values.
+        Raises an error if not implemented by derived class."""
+        raise NotImplementedError("Function output not implemented")
+
+    def pwm(self, pin, freq):
+        """Returns a PWM of the pin with the methods start(duty_cycle) and ChangeDutyCycle(duty_cycle).
+        Raises an error if not implemented by derived class."""
+        raise NotImplementedError("Function pwm not implemented")
+
+    def cleanup(self):
+        """Releases all pins."""
+        pass
+
+
+class RPiGPIODriver(GPIODriver):
+    """Driver for the GPIO pins of a Raspberry Pi, uses RPi.GPIO."""
+
+    def __init__(self):
+        import RPi.GPIO
+        self.GPIO = RPi.GPIO
+        self.GPIO.setmode(self.GPIO.BCM)
+        # self.GPIO.setwarnings(False)
+
+    def setup(self, pins):
+        self.GPIO.setup(pins, self.GPIO.OUT)
+
+    def output(self, pins, values):
+        self.GPIO.output(pins, values)
+
+    def pwm(self, pin, freq):
+        return self.GPIO.PWM(pin, freq)
+
+    def cleanup(self):
+        self.GPIO.cleanup()
+
+
+class MockGPIODriver(GPIODriver):
+    """GPIO driver without hardware, which records every output with a timestamp of
+    the monotonic clock (see GPIO_EVENT_DTYPE). The recording is saved to record_file
+    (.npy) when cleaning up, if specified."""
+
+    def __init__(self, record_file=None, capacity=65536):
+        self.record_file = record_file
+        self.events = np.zeros((capacity,), dtype=GPIO_EVENT_DTYPE)
+        self.size = 0
+
+    def record(self, pins, values):
+        if isinstance(pins, int):
+            pins = [pins]
+        if not isinstance(values, (list, tuple)):
+            values = [values]*len(pins)
+
+        if self.size + len(pins) > self.events.shape[0]:
+            self.events = np.concatenate(
+                (self.events, np.zeros_like(self.events)))
+
+        t = time.perf_counter()
+        for p, v in zip(pins, values):
+            self.events[self.size] = (t, p, v)
+            self.size += 1
+
+    def setup(self, pins):
+        pass
+
+    def output(self, pins, values):
+        self.record(pins, values)
+
+    def pwm(self, pin, freq):
+        return MockPWM(self, pin)
+
+    def recording(self):
+        """Returns all recorded events."""
+        return self.events[:self.size]
+
+    def cleanup(self):
+        events = self.recording()
+        pins, pulses = np.unique(
+            events["pin"][events["value"] == 1], return_counts=True)
+        print("GPIO mock recorded %d events, high outputs per pin: %s" %
+              (events.shape[0], dict(zip(pins.tolist(), pulses.tolist()))))
+        if self.record_file is not None:
+            np.save(self.record_file, events)
+            print("GPIO recording saved to %s" % self.record_file)
+
+
+class MockPWM:
+    """PWM of the GPIO mock, duty cycle changes are recorded as events of the pin."""
+
+    def __init__(self, driver, pin):
+        self.driver = driver
+        self.pin = pin
+
+    def start(self, duty_cycle):
+        self.driver.record(self.pin, duty_cycle)
+
+    def ChangeDutyCycle(self, duty_cycle):
+        self.driver.record(self.pin, duty_cycle)
+
+
+def gpioDriverAvailable(name):
+    """Returns True if the GPIO driver name ('rpi' or 'mock') can be used on this machine."""
+    if name == "rpi":
+        try:
+            return importlib.util.find_spec('RPi.GPIO') is not None
+        except (ImportError, ValueError):
+            return False
+    return name == "mock"
+
+
+def createGPIODriver(config):
+    """Creates the GPIO driver selected in the config."""
+    if config["gpio_driver"] == "rpi":
+        return RPiGPIODriver()
+    elif config["gpio_driver"] == "mock":
+        return MockGPIODriver(config["gpio_record_file"])
+    raise ValueError("Unknown GPIO driver: " + str(config["gpio_driver"]))
+
@@ -1,25 +1,16 @@
 
 import sys
 import time
-import RPi.GPIO as GPIO
 import numpy as np
 
 
-def initMotorCtrl():
-    GPIO.setmode(GPIO.BCM)
-    # GPIO.setwarnings(False)
-
-
-def cleanup():
-    GPIO.cleanup()
-
-
 class StepperCtrl:
     """ Stepper controller for multiple steppers that are controlled with individual pololu DRV8825 boards.
     """
 
-    def __init__(self, dir_pins, step_pins, res_pins, micro_stepping=1):
-        """The dimension of all parameters has to match the number of steppers (N):
+    def __init__(self, gpio, dir_pins, step_pins, res_pins, micro_stepping=1):
+        """The pins are controlled by the GPIO driver gpio (see GPIODriver).
+        The dimension of all other parameters has to match the number of steppers (N):
          - dir_pins: N values
          - step_pins: N values
          - step_pins: N lists of 3 values for the 3 microstepping pins.
@@ -27,18 +18,31 @@ class StepperCtrl:
         assert(len(dir_pins) == len(step_pins))
         assert(len(step_pins) == len(res_pins))
 
+        self.gpio = gpio
         self.dir_pins = dir_pins
         self.step_pins = step_pins
         self.res_pins = res_pins
         self.micro_stepping = micro_stepping
 
+        # Step pins of all combinations of motors (bit mask) that step at the same tick
+        self.tick_pins = [[p for s, p in enumerate(step_pins) if (m >> s) & 1]
+                          for m in range(1 << len(step_pins))]
+
+        # Timeline of the step scheduler
+        self.deadline = 0
+        self.max_lag = 0
+        self.lateness_sq = 0
+        self.requested_time = 0
+        self.active_time = 0
+        self.tick_count = 0
+
     def initGPIO(self):
 
-        GPIO.setup(self.dir_pins, GPIO.OUT)
-        GPIO.setup(self.step_pins, GPIO.OUT)
+        self.gpio.setup(self.dir_pins)
+        self.gpio.setup(self.step_pins)
 
         for p in self.res_pins:
-            GPIO.setup(p, GPIO.OUT)
+            self.gpio.setup(p)
 
         self.setMicrostepping(self.micro_stepping)
 
@@ -51,52 +55,117 @@ class StepperCtrl:
                              32: (1, 0, 1)}
         self.micro_stepping = mstep
         for p in self.res_pins:
-            GPIO.output(p, microstepping_map[mstep])
+            self.gpio.output(p, microstepping_map[mstep])
 
     def doSteps(self, dirs, steps, stepDelay=0.00000001):
         """Execute steps on all stepper motors in parallel. 
         All movements are linearly interpolated and executed over the same timespan.
-        Executing this movement requires approximately max(steps)*stepDelay seconds."""
+        The steps of all motors are merged into one timeline with an integer DDA, which has a tick
+        for every step of the motor with the most steps. The pulses of a tick are emitted at its
+        deadline on the monotonic clock, consecutive moves continue the same timeline.
+        Executing this movement requires max(steps)*stepDelay seconds."""
 
         maxSteps = max(steps)
-        chCnt = len(steps)
-        GPIO.output(self.dir_pins, dirs)
-
-        # Compute indices where we have to do a step
-        # We have to figure out how to move the steppers
-        # in order move them during the same timespan.
-        step_pos = []
-        for s in range(chCnt):
-            step_pos.append(np.linspace(0, maxSteps-1, steps[s]))
+        if maxSteps == 0:
+            return
+        output = self.gpio.output
+        output(self.dir_pins, dirs)
+
+        # Motor s steps at tick i if ((i+1)*steps[s] + maxSteps//2)//maxSteps increases.
+        # The bits of the tick mask indicate the motors that step.
+        ticks = np.arange(1, maxSteps + 1, dtype=np.int64)
+        mask = np.zeros((maxSteps,), dtype=np.int64)
+        for s in range(len(steps)):
+            mask |= (np.diff((ticks*steps[s] + maxSteps//2)//maxSteps, prepend=0) > 0) << s
+
+        # Restart the timeline if the motors were idle
+        now = time.perf_counter()
+        if self.deadline < now - stepDelay:
+            self.deadline = now
+        start = self.deadline
 
         # Execute steps
-        for i in range(maxSteps):
-            for s in range(chCnt):
-                if step_pos[s].shape[0] > 0 and step_pos[s][0] - i <= 0.5:
-                    GPIO.output(self.step_pins[s], True)
-                    GPIO.output(self.step_pins[s], False)
-
-                    step_pos[s] = np.delete(step_pos[s], 0, 0)
-
-                    time.sleep(stepDelay)
+        lateness_sq = 0
+        for i, m in enumerate(mask.tolist()):
+            late = waitUntil(start + i*stepDelay)
+            lateness_sq += late*late
+            if m:
+                output(self.tick_pins[m], True)
+                output(self.tick_pins[m], False)
+
+        self.deadline = start + maxSteps*stepDelay
+        now = time.perf_counter()
+        self.max_lag = max(self.max_lag, now - self.deadline)
+        self.requested_time += maxSteps*stepDelay
+        self.active_time += max(now, self.deadline) - start
+        self.tick_count += maxSteps
+        self.lateness_sq += lateness_sq
+
+    def stepRateReport(self):
+        """Returns the requested and achieved step rate (steps per second of the motor with
+        the most steps) of all executed moves and the timing jitter (RMS delay of all ticks)."""
+        if self.tick_count == 0:
+            return "No steps executed."
+        return "Step rate: requested %.0f steps/s, achieved %.0f steps/s, max. lag %.2f ms, jitter %.1f us" % (
+            self.tick_count/self.requested_time, self.tick_count/self.active_time, max(self.max_lag, 0)*1000,
+            np.sqrt(self.lateness_sq/self.tick_count)*1e6)
+
+
+def waitUntil(deadline):
+    """Waits until the monotonic clock (time.perf_counter) reaches deadline.
+    Sleeps while the deadline is far away and spins for the remaining time.
+    Returns how many seconds the deadline was missed."""
+    now = time.perf_counter()
+    if deadline - now > 0.002:
+        time.sleep(deadline - now - 0.001)
+    while now < deadline:
+        now = time.perf_counter()
+    return now - deadline
 
 
 class ServoCtrl:
-    """Controls a servo by using the GPIO.pwm class. """
+    """Controls a servo by using the PWM of the GPIO driver.
+    The servo is assumed to be at init_duty_cycle after initialization. Moves to the current
+    position are skipped. A move may return before the servo settled, the next servo move
+    waits until the previous one settled."""
 
-    def __init__(self, pwm_pin, ctrl_freq=50, init_duty_cycle=0.1):
+    def __init__(self, gpio, pwm_pin, ctrl_freq=50, init_duty_cycle=0.1):
+        self.gpio = gpio
         self.ctrl_freq = ctrl_freq
         self.pwm_pin = pwm_pin
         self.init_duty_cycle = init_duty_cycle
 
+        self.duty_cycle = init_duty_cycle
+        self.settled = 0
+        self.move_count = 0
+        self.skip_count = 0
+        self.wait_time = 0
+
     def initGPIO(self):
-        GPIO.setup(self.pwm_pin, GPIO.OUT)
-        self.pwm = GPIO.PWM(self.pwm_pin, self.ctrl_freq)
+        self.gpio.setup(self.pwm_pin)
+        self.pwm = self.gpio.pwm(self.pwm_pin, self.ctrl_freq)
         self.pwm.start(self.init_duty_cycle)
 
-    def moveTo(self, duty_cycle, delay=0.3):
-        """Set duty cycle in percent (0.0-100.0). This function 
-        blocks for 'delay' seconds in order to wait for the servo
-        to execute the move."""
+    def moveTo(self, duty_cycle, delay=0.3, block=None):
+        """Set duty cycle in percent (0.0-100.0). The servo requires 'delay' seconds
+        to execute the move. This function blocks for 'block' seconds (defaults to 'delay'),
+        the remaining time overlaps with whatever is executed next."""
+        if duty_cycle == self.duty_cycle:
+            self.skip_count += 1
+            return
+
+        start = time.perf_counter()
+        waitUntil(self.settled)
         self.pwm.ChangeDutyCycle(duty_cycle)
-        time.sleep(delay)
+        self.duty_cycle = duty_cycle
+        now = time.perf_counter()
+        self.settled = now + delay
+        waitUntil(now + (delay if block is None else min(block, delay)))
+
+        self.move_count += 1
+        self.wait_time += time.perf_counter() - start
+
+    def servoReport(self):
+        """Returns the number of executed and skipped moves and the time spent waiting for the servo."""
+        return "Servo: %d moves, %d skipped, waited %.1f s" % (
+            self.move_count, self.skip_count, self.wait_time)
@@ -1,7 +1,9 @@
 import numpy as np
 import re
+import queue
 import sys
 import time
+import threading
 
 from multiprocessing import Process, Queue
 
@@ -14,6 +16,21 @@ def processPlotterQueue(plotter):
     plotter.processQueueAsync()
 
 
+class JobFile:
+    """Queue item which refers to a binary job file (see writeJob).
+    Only the file name is sent to the worker process, which maps the file itself."""
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+
+
+class StepPlanFile:
+    """Queue item which refers to a precompiled step plan (see StepPlanCompiler)."""
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+
+
 class BasePlotter:
     """Base class of all plotter implementations. Always call '__init__' in the derived class after
     setting up all (custom) member variables. Otherwise the (custom) config and calibration is
@@ -21,6 +38,24 @@ class BasePlotter:
 
     def __init__(self, config, initial_lengh, PhysicsEngineClass):
         """Sets up the worker process and initializes the system."""
+        self.initState(config, initial_lengh, PhysicsEngineClass)
+
+        self.workerProcess = Process(target=processPlotterQueue, args=(self,))
+        self.workerQueue = Queue(1000)
+        self.workerProcess.start()
+
+        # Items are sent to the worker process in batches (lists of items).
+        # A batch is sent when it is full or when its first item waited for batchLatency seconds.
+        self.batchSize = config["queue_batch_size"]
+        self.batchLatency = config["queue_batch_latency"]
+        self.batch = []
+        self.batchStart = 0
+        self.batchLock = threading.Lock()
+        self.batchThread = threading.Thread(target=self.flushQueuePeriodically, daemon=True)
+        self.batchThread.start()
+
+    def initState(self, config, initial_lengh, PhysicsEngineClass):
+        """Initializes calibration, physics and the state of the plotter."""
         base = config["base_width"]
         self.calib = Calibration(base,
                                  PhysicsEngineClass.calcOrigin(
@@ -35,41 +70,174 @@ class BasePlotter:
         self.speed = 10000
         self.penIsDown = False
 
-        self.workerProcess = Process(target=processPlotterQueue, args=(self,))
-        self.workerQueue = Queue(1000)
-        self.workerProcess.start()
-
     def shutdown(self):
         """Stops the worker queue and the worker process."""
         print("Shutting down..")
+        self.flushQueue()
         self.workerQueue.put(None)
         self.workerQueue.close()
         self.workerQueue.join_thread()
         self.workerProcess.join()
 
+    def queueItem(self, item):
+        """Adds an item (command, stroke or job file) to the current batch for the worker process.
+        This will block if the batch is full and the queue is full."""
+        with self.batchLock:
+            if len(self.batch) == 0:
+                self.batchStart = time.time()
+            self.batch.append(item)
+
+            if len(self.batch) >= self.batchSize:
+                self.sendBatch()
+
+    def flushQueue(self):
+        """Immediately sends all batched items to the worker process."""
+        with self.batchLock:
+            self.sendBatch()
+
+    def sendBatch(self):
+        # Requires batchLock
+        if len(self.batch) > 0:
+            self.workerQueue.put(self.batch)
+            self.batch = []
+
+    def flushQueuePeriodically(self):
+        """Sends incomplete batches after batchLatency seconds.
+        Runs in a background thread of the main process."""
+        while True:
+            time.sleep(self.batchLatency)
+            with self.batchLock:
+                if len(self.batch) > 0 and time.time() - self.batchStart >= self.batchLatency:
+                    self.sendBatch()
+
     def executeGCodeFile(self, file_name):
         """Opens the specified gcode file and pushes each command into the worker queue.
         This will block if the queue is full."""
         with open(file_name, 'r') as f:
-            lines = f.readlines()
+            for c in f:
+                self.queueItem(c.strip())
 
-        for c in lines:
-            self.workerQueue.put(c.strip())
+    def executeJobFile(self, file_name):
+        """Pushes a binary job file (see writeJob) into the worker queue.
+        The commands are not read by the calling process."""
+        self.queueItem(JobFile(file_name))
+
+    def executeStepPlanFile(self, file_name):
+        """Pushes a precompiled step plan into the worker queue.
+        Only supported by plotters which execute steps (see executeStepPlan)."""
+        self.queueItem(StepPlanFile(file_name))
+
+    def executeToolpath(self, toolpath):
+        """Pushes all strokes of a toolpath into the worker queue.
+        This will block if the queue is full."""
+        for stroke in toolpath.iterStrokes():
+            self.queueItem(stroke)
 
     def processQueueAsync(self):
         """Plotter worker function which runs in the worker process. 
         Processes new commands by reading from the worker queue."""
         print("Plotter process started")
 
-        item = self.workerQueue.get()
-        while(item is not None):
+        for item in self.iterQueue():
+            self.executeItem(item)
+
+        print("Plotter process stopped")
+        exit(0)
 
+    def iterQueue(self, chunkSize=1024):
+        """Iterates over all items of the worker queue until None is received.
+        Batches are expanded into their items. Job files are memory mapped and
+        expanded into single command records, chunkSize records at a time.
+        Calls queueIdle before waiting for the next batch, if the queue is empty.
+        Should only be called from the worker process."""
+        batch = self.getBatch()
+        while(batch is not None):
+            # Single items might be put into the queue directly
+            if not isinstance(batch, list):
+                batch = [batch]
+
+            for item in batch:
+                if isinstance(item, JobFile):
+                    for cmds in iterJob(item.file_name):
+                        for i in range(0, cmds.shape[0], chunkSize):
+                            yield from cmds[i:i+chunkSize].tolist()
+                else:
+                    yield item
+
+            batch = self.getBatch()
+
+    def getBatch(self):
+        """Returns the next batch of the worker queue. Calls queueIdle
+        if no batch is available yet and waits for the next one."""
+        try:
+            return self.workerQueue.get_nowait()
+        except queue.Empty:
+            self.queueIdle()
+            return self.workerQueue.get()
+
+    def queueIdle(self):
+        """Called by the worker process when all received items are executed
+        and the worker queue is empty."""
+        pass
+
+    def executeItem(self, item):
+        """Executes a queued item, either a gcode command, a command record of a job file
+        or a toolpath stroke. Should only be called from the worker process."""
+        if isinstance(item, str):
             self.executeCmd(item)
+        elif isinstance(item, StepPlanFile):
+            self.executeStepPlan(item.file_name)
+        elif isinstance(item[0], bytes):
+            self.executeRecord(*item)
+        else:
+            self.executeStroke(*item)
 
-            item = self.workerQueue.get()
+    def executeRecord(self, code, x, y, r, a, b, s, hasX, hasY, hasR, hasA, hasB, hasS):
+        """Executes a parsed command (see GCODE_DTYPE), equivalent to executeCmd.
+        Should only be called from the worker process."""
+        if code == b"G0":
+            if hasS:
+                self.setSpeed(s)
 
-        print("Plotter process stopped")
-        exit(0)
+            self.moveToPos([x if hasX else self.currPos[0],
+                            y if hasY else self.currPos[1]])
+
+        elif code == b"G28":
+            self.moveToPos([0, 0])
+
+        elif code == b"G2":
+            if hasS:
+                self.setSpeed(s)
+
+            if not hasR or not hasX or not hasY:
+                print("Unexpected cmd type. Failed to process command.")
+                return
+
+            self.moveArc([x, y], r, a if hasA else 0, b if hasB else 360)
+
+        elif code == b"M3":
+            self.penDown()
+        elif code == b"M4":
+            self.penUp()
+        else:
+            print("Unexpected cmd type. Failed to process command.")
+
+    def executeStroke(self, points, penDown, speed):
+        """Executes a toolpath stroke. Should only be called from the worker process."""
+        if penDown != self.penIsDown:
+            if penDown:
+                self.penDown()
+            else:
+                self.penUp()
+
+        if not np.isnan(speed):
+            self.setSpeed(speed)
+
+        for p in points:
+            # Strokes usually start at the current position
+            if p[0] == self.currPos[0] and p[1] == self.currPos[1]:
+                continue
+            self.moveToPos(p)
 
     def executeCmd(self, cmd):
         """Executes a command. Should only be called from the worker process."""
@@ -96,7 +264,7 @@ class BasePlotter:
             if "S" in d:
                 self.setSpeed(d["S"])
 
-            if "R" not in d and "X" not in d and "Y" not in d:
+            if "R" not in d or "X" not in d or "Y" not in d:
                 print(d)
                 print("Unexpected cmd type. Failed to process command.")
                 return
@@ -111,6 +279,11 @@ class BasePlotter:
         else:
             print("Unexpected cmd type. Failed to process command.")
 
+    def executeStepPlan(self, file_name):
+        """Executes a precompiled step plan. 
+        Raises an error if not implemented by derived class."""
+        raise NotImplementedError("Function executeStepPlan not implemented")
+
     def moveToPos(self, targetPos):
         """Move to specified position. 
         Raises an error if not implemented by derived class."""
@@ -0,0 +1,124 @@
+import numpy as np
+import time
+import imageio
+
+from . import plotter_base
+from plotter.utils.gcode import sampleArc
+from plotter.utils.helper import overrides
+from plotter.utils.raster import rasterizeSegments, composeImage
+from plotter.utils.segments import SegmentBuffer
+
+
+class RasterPlotter(plotter_base.BasePlotter):
+    """Headless plotter implementation. Renders all drawing moves into an image without a display.
+    The segments of all moves are collected in growable buffers and rasterized in large chunks
+    (see rasterizeSegments) into a canvas with pxPerMM pixels per mm, which covers the drawing
+    area (base width x height mm). The image is written to output when the queue is stopped.
+    Non-drawing moves are drawn as red overlay if travel is True."""
+
+    def __init__(self, config, initial_lengh, physicsEngineClass, output, pxPerMM=4,
+                 antialias=False, travel=False, height=700, chunkSize=262144):
+        self.output = output
+        self.pxPerMM = pxPerMM
+        self.antialias = antialias
+        self.travel = travel
+        self.height = height
+        self.chunkSize = chunkSize
+        plotter_base.BasePlotter.__init__(
+            self, config, initial_lengh, physicsEngineClass)
+
+    @overrides(plotter_base.BasePlotter)
+    def initState(self, config, initial_lengh, PhysicsEngineClass):
+        plotter_base.BasePlotter.initState(
+            self, config, initial_lengh, PhysicsEngineClass)
+        self.segments = SegmentBuffer()
+        self.segments_nodraw = SegmentBuffer()
+        self.drawnSegments = 0
+        self.travelSegments = 0
+
+    def initCanvas(self):
+        shape = (int(np.ceil(self.height*self.pxPerMM)),
+                 int(np.ceil(self.calib.base*self.pxPerMM)))
+        self.canvas = np.zeros(shape, dtype=np.float32)
+        self.canvas_nodraw = np.zeros(shape, dtype=np.float32) if self.travel else None
+
+    def addPolyline(self, points):
+        """Adds the segments between the points (N,2), which start at the current position."""
+        if self.penIsDown:
+            self.segments.addPolyline(points + self.calib.origin)
+            if len(self.segments) >= self.chunkSize:
+                self.rasterize()
+        elif self.travel:
+            self.segments_nodraw.addPolyline(points + self.calib.origin)
+            if len(self.segments_nodraw) >= self.chunkSize:
+                self.rasterize()
+        self.currPos = np.array(points[-1], dtype=np.float64)
+
+    def rasterize(self):
+        """Draws all collected segments into the canvas."""
+        rasterizeSegments(self.canvas, self.segments[:], self.pxPerMM, self.antialias)
+        self.drawnSegments += len(self.segments)
+        self.segments.clear()
+        if self.travel:
+            rasterizeSegments(self.canvas_nodraw, self.segments_nodraw[:],
+                              self.pxPerMM, self.antialias)
+            self.travelSegments += len(self.segments_nodraw)
+            self.segments_nodraw.clear()
+
+    @overrides(plotter_base.BasePlotter)
+    def moveToPos(self, targetPos):
+        self.addPolyline(np.array([self.currPos, targetPos], dtype=np.float64))
+
+    @overrides(plotter_base.BasePlotter)
+    def moveArc(self, center, radius, startAngle, endAngle):
+        # Render the arc with the same sampling as the hardware plotter
+        points = sampleArc(
+            center, radius, startAngle, endAngle, self.calib.resolution)
+        self.moveToPos(points[0])
+        self.addPolyline(points)
+
+    @overrides(plotter_base.BasePlotter)
+    def executeStroke(self, points, penDown, speed):
+        # The whole stroke is added at once
+        self.penIsDown = penDown
+        if not np.isnan(speed):
+            self.setSpeed(speed)
+        # Strokes usually start at the current position
+        if len(points) > 0 and np.array_equal(points[0], self.currPos):
+            points = points[1:]
+        if len(points) > 0:
+            self.addPolyline(np.concatenate((self.currPos[None], points)))
+
+    @overrides(plotter_base.BasePlotter)
+    def penUp(self):
+        self.penIsDown = False
+
+    @overrides(plotter_base.BasePlotter)
+    def penDown(self):
+        self.penIsDown = True
+
+    def saveImage(self):
+        """Rasterizes the remaining segments and writes the image."""
+        self.rasterize()
+        imageio.imwrite(self.output, composeImage(self.canvas, self.canvas_nodraw))
+
+    @overrides(plotter_base.BasePlotter)
+    def processQueueAsync(self):
+        print("Plotter process started")
+        self.initCanvas()
+
+        i = 0
+        start = time.time()
+        for item in self.iterQueue():
+            self.executeItem(item)
+            i += 1
+
+        self.saveImage()
+        duration = time.time() - start
+        print("Rendered %d items (%d drawing and %d travel segments) in %.1f s (%.0f items per minute)" %
+              (i, self.drawnSegments, self.travelSegments, duration, i*60/max(duration, 1e-9)))
+        print("Image saved to %s (%dx%d px)" %
+              (self.output, self.canvas.shape[1], self.canvas.shape[0]))
+
+        print("Plotter process stopped")
+        exit(0)
@@ -0,0 +1,290 @@
+import numpy as np
+
+from . import plotter_base
+from plotter.utils.gcode import *
+from plotter.utils.helper import overrides
+from plotter.utils.math import segmentCordLinear
+from plotter.utils.planner import MotionPlanner
+from plotter.utils.ringbuffer import RingBuffer, stepRecords
+from plotter.utils.stepplan import StepPlanWriter
+from plotter.utils.stepsim import IDEAL_MOVE_DTYPE, DeviationStats, tickPositions, idealDeviation
+
+
+class StepPlotter(plotter_base.BasePlotter):
+    """Base class of plotters which break down all movements into short stepper moves.
+    The steppers interpolate the cord lengths linearly during a move, so the pen doesn't follow
+    a straight line due to the belt coordinate system. Every move is split adaptively until
+    the pen deviates about movement_tolerance mm from the ideal path at most (see segmentCordLinear).
+    The step quantization adds up to about a step on top (see StepSimulator).
+    The cord lengths are rounded to absolute integer step positions, so the rounding error
+    never accumulates. The step deltas pass through the motion planner, which limits the
+    acceleration of the steppers (see MotionPlanner). The planned moves are passed to queueSteps
+    together with their delays between two steps. Pen moves are passed to queuePen, the
+    steppers stop before every pen move. Pen moves to the current pen position are dropped.
+    """
+
+    def initState(self, config, initial_lengh, PhysicsEngineClass):
+        plotter_base.BasePlotter.initState(
+            self, config, initial_lengh, PhysicsEngineClass)
+        self.servo_pos_up = config["servo_pos_up"]
+        self.servo_pos_down = config["servo_pos_down"]
+        self.movement_tolerance = config["movement_tolerance"]
+
+        # Steps of both steppers relative to the home position
+        self.homeCordLength = self.currCordLength.copy()
+        self.currSteps = np.zeros((2,), dtype=np.int64)
+        self.planner = MotionPlanner(config, self.calib.stepsPerMM)
+
+    @overrides(plotter_base.BasePlotter)
+    def penUp(self):
+        # The servo starts in the up position
+        if not self.penIsDown:
+            return
+        self.flushPlanner()
+        self.queuePen(self.servo_pos_up)
+        self.penIsDown = False
+
+    @overrides(plotter_base.BasePlotter)
+    def penDown(self):
+        if self.penIsDown:
+            return
+        self.flushPlanner()
+        self.queuePen(self.servo_pos_down)
+        self.penIsDown = True
+
+    @overrides(plotter_base.BasePlotter)
+    def moveToPos(self, targetPos):
+        self.queuePath(np.stack((self.currPos, np.asarray(targetPos, dtype=np.float64))))
+
+    @overrides(plotter_base.BasePlotter)
+    def moveArc(self, center, radius, startAngle, endAngle):
+        # Half of the tolerance is used for the chords of the arc, the other half
+        # for the segmentation of the chords (see queuePath).
+        # The max. chord length follows from the distance of the chord to the arc.
+        sagitta = min(self.movement_tolerance/2, radius)
+        points = sampleArc(center, radius, startAngle, endAngle,
+                           max(2*np.sqrt(2*radius*sagitta - sagitta**2), 1/self.calib.stepsPerMM))
+        self.moveToPos(points[0])
+        self.queuePath(points, self.movement_tolerance/2)
+
+    def queuePath(self, points, tolerance=None):
+        """Queues the stepper movements along the polyline points (N,2), starting at the
+        current position points[0]. The lines are segmented adaptively, so the pen deviates about
+        tolerance mm (movement_tolerance by default) from them at most (see segmentCordLinear).
+        The last point becomes the current position."""
+        if tolerance is None:
+            tolerance = self.movement_tolerance
+        points, cordLengths = segmentCordLinear(
+            self.physicsEngine, points, tolerance, 1/self.calib.stepsPerMM)
+        self.queueCordMoves(points[1:], cordLengths[1:])
+
+    def queueCordMoves(self, points, cordLengths):
+        """Queues the stepper movements from the current cord lengths
+        to the cord lengths (N,2) of all points (N,2), one after another.
+        The last point becomes the current position."""
+        if len(points) == 0:
+            return
+
+        # Round the absolute step positions instead of the deltas,
+        # the steppers never deviate more than half a step from the exact cord lengths
+        steps = self.stepPositions(cordLengths)
+        deltas = np.diff(steps, axis=0, prepend=self.currSteps[None])
+
+        self.currSteps = steps[-1]
+        self.currCordLength = self.homeCordLength + \
+            self.currSteps/self.calib.stepsPerMM
+        self.currPos = np.array(points[-1], dtype=np.float64)
+
+        # Moves shorter than a step don't move the steppers
+        deltas = deltas[np.any(deltas != 0, axis=1)]
+        if deltas.shape[0] > 0:
+            stepDelay = 1/self.speed*self.config["micro_stepping"]
+            self.queuePlannedSteps(*self.planner.add(deltas, stepDelay))
+
+    def flushPlanner(self):
+        """Queues all moves of the motion planner, the steppers stop at the end."""
+        if self.planner.hasMoves():
+            self.queuePlannedSteps(*self.planner.flush())
+
+    def queuePlannedSteps(self, steps, stepDelay):
+        if steps.shape[0] > 0:
+            self.queueSteps(steps, stepDelay)
+
+    def plannerReport(self):
+        """Returns the planned job time and the time without acceleration limits."""
+        return "Planned job time: %.1f s, without acceleration limits: %.1f s" % (
+            self.planner.plannedTime, self.planner.naiveTime)
+
+    def stepPositions(self, cordLengths):
+        """Returns the absolute step positions of the cord lengths, relative to the home position."""
+        return np.rint((cordLengths - self.homeCordLength) *
+                       self.calib.stepsPerMM).astype(np.int64)
+
+    def setCordLength(self, cordLength):
+        """Sets the current cord lengths, e.g. after executing a step plan.
+        The lengths have to be on the step grid of the current calibration."""
+        self.currSteps = self.stepPositions(cordLength)
+        self.currCordLength = self.homeCordLength + \
+            self.currSteps/self.calib.stepsPerMM
+
+    def queueSteps(self, steps, stepDelay):
+        """Queue the integer steps (N,2) of both steppers, one move after another,
+        with the delays (N,) between two steps of the stepper with the most steps.
+        Raises an error if not implemented by derived class."""
+        raise NotImplementedError("Function queueSteps not implemented")
+
+    def queuePen(self, pos):
+        """Queue a servo move to the position pos.
+        Raises an error if not implemented by derived class."""
+        raise NotImplementedError("Function queuePen not implemented")
+
+
+class StepPlanCompiler(StepPlotter):
+    """Compiles gcode or binary jobs into a step plan file, which contains all stepper
+    and servo moves of the hardware plotter. A step plan can be executed by the hardware
+    plotter without any kinematics or floating point computations.
+    The compiler runs in the calling process, no worker process is started."""
+
+    def __init__(self, config, initial_lengh, physicsEngineClass, file_name):
+        self.initState(config, initial_lengh, physicsEngineClass)
+        self.writer = StepPlanWriter(
+            file_name, self.calib, config["micro_stepping"])
+
+    def compileGCode(self, gcode):
+        """Compiles a gcode stream (iterable of string commands)."""
+        for cmd in gcode:
+            self.executeCmd(cmd.strip())
+
+    def compileJob(self, file_name):
+        """Compiles a binary job file (see writeJob)."""
+        for cmds in iterJob(file_name):
+            for record in cmds.tolist():
+                self.executeRecord(*record)
+
+    def close(self):
+        """Finishes the step plan and returns the number of records."""
+        self.flushPlanner()
+        self.writer.close(self.currPos, self.currCordLength, self.penIsDown)
+        return self.writer.numRecords
+
+    @overrides(StepPlotter)
+    def queueSteps(self, steps, stepDelay):
+        self.writer.putRecords(stepRecords(steps, stepDelay))
+
+    @overrides(StepPlotter)
+    def queuePen(self, pos):
+        self.writer.put(RingBuffer.PEN, 0, 0, pos)
+
+
+class StepSimulator(StepPlotter):
+    """Simulates the stepper moves of the hardware plotter without executing them.
+    The moves pass through the same segmentation, step rounding and motion planner as on the
+    hardware plotter. Every planned move is expanded into the ticks of the stepper DDA (see
+    tickPositions) and the step positions are mapped back to pen positions with the forward
+    kinematics. The deviation of every pen position from the ideal path (straight lines and arcs
+    of the commands) is accumulated separately for drawing and travel moves.
+    The simulator runs in the calling process, no worker process is started.
+
+    Pass a callback onTicks(points, penDown) to receive the pen positions (N,2) after every tick,
+    e.g. to render the quantized path."""
+
+    def __init__(self, config, initial_lengh, physicsEngineClass, onTicks=None):
+        self.initState(config, initial_lengh, physicsEngineClass)
+        self.onTicks = onTicks
+
+    @overrides(StepPlotter)
+    def initState(self, config, initial_lengh, PhysicsEngineClass):
+        StepPlotter.initState(self, config, initial_lengh, PhysicsEngineClass)
+        # Ideal moves which are not completely simulated yet
+        self.moves = np.zeros((0,), dtype=IDEAL_MOVE_DTYPE)
+        self.moveStepCount = 0
+        self.arc = None
+
+        # Step positions and number of steps of the simulated ticks
+        self.currTickSteps = np.zeros((2,))
+        self.tickStepCount = 0
+        self.drawDeviation = DeviationStats()
+        self.travelDeviation = DeviationStats()
+
+    def simulateGCode(self, gcode):
+        """Simulates a gcode stream (iterable of string commands)."""
+        for cmd in gcode:
+            self.executeCmd(cmd.strip())
+
+    def simulateJob(self, file_name):
+        """Simulates a binary job file (see writeJob)."""
+        for cmds in iterJob(file_name):
+            for record in cmds.tolist():
+                self.executeRecord(*record)
+
+    def close(self):
+        """Simulates all remaining moves of the motion planner."""
+        self.flushPlanner()
+
+    @overrides(StepPlotter)
+    def moveArc(self, center, radius, startAngle, endAngle):
+        # The move to the start of the arc is a straight line
+        a = np.radians(startAngle)
+        self.moveToPos([center[0] + radius*np.cos(a), center[1] + radius*np.sin(a)])
+        self.arc = (center, radius)
+        StepPlotter.moveArc(self, center, radius, startAngle, endAngle)
+        self.arc = None
+
+    @overrides(StepPlotter)
+    def queueCordMoves(self, points, cordLengths):
+        if len(points) == 0:
+            return
+        steps = self.stepPositions(cordLengths)
+        counts = np.sum(np.abs(np.diff(steps, axis=0, prepend=self.currSteps[None])), axis=1)
+
+        moves = np.zeros((len(points),), dtype=IDEAL_MOVE_DTYPE)
+        moves["start"][0] = self.currPos
+        moves["start"][1:] = points[:-1]
+        moves["end"] = points
+        if self.arc is None:
+            moves["radius"] = np.nan
+        else:
+            moves["center"] = self.arc[0]
+            moves["radius"] = self.arc[1]
+        moves["stepCount"] = self.moveStepCount + np.cumsum(counts)
+        self.moveStepCount = moves["stepCount"][-1]
+        self.moves = np.concatenate((self.moves, moves))
+
+        StepPlotter.queueCordMoves(self, points, cordLengths)
+
+    @overrides(StepPlotter)
+    def queueSteps(self, steps, stepDelay):
+        # Every planned move is a part of a single ideal move
+        stepCount = self.tickStepCount + np.cumsum(np.sum(np.abs(steps), axis=1))
+        moves = self.moves[:np.searchsorted(self.moves["stepCount"], stepCount[-1]) + 1]
+        index = np.searchsorted(moves["stepCount"], stepCount)
+
+        ticks, move = tickPositions(steps)
+        ticks += self.currTickSteps
+        self.currTickSteps = ticks[-1].copy()
+        self.tickStepCount = stepCount[-1]
+
+        ticks /= self.calib.stepsPerMM
+        ticks += self.homeCordLength
+        points = self.physicsEngine.cordLengths2Points(ticks)
+        deviation = idealDeviation(points, moves, index[move])
+        if self.penIsDown:
+            self.drawDeviation.add(points, deviation)
+        else:
+            self.travelDeviation.add(points, deviation)
+
+        # Drop all completely simulated moves
+        self.moves = self.moves[np.searchsorted(
+            self.moves["stepCount"], self.tickStepCount, side='right'):]
+
+        if self.onTicks is not None:
+            self.onTicks(points, self.penIsDown)
+
+    @overrides(StepPlotter)
+    def queuePen(self, pos):
+        pass
+
+    def deviationReport(self):
+        """Returns the deviation of the simulated pen positions from the ideal path."""
+        return "Deviation of drawing moves: %s\nDeviation of travel moves:  %s" % (
+            self.drawDeviation, self.travelDeviation)
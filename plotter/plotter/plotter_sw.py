@@ -2,6 +2,8 @@ import numpy as np
 import time
 from plotter.utils.helper import overrides
 from . import plotter_base
+from plotter.utils.gcode import sampleArc
+from plotter.utils.segments import SegmentBuffer
 
 import importlib
 try:
@@ -15,22 +17,19 @@ else:
     import matplotlib
     matplotlib.use('TkAgg')   # Use tk backend in our virtual environment
     import matplotlib.pyplot as plt
-
-    plt.ion()
-    plt.show()
+    from matplotlib.collections import LineCollection
 
     class SimulationPlotter(plotter_base.BasePlotter):
-        """Simulation plotter implementation. Renderes movements to a matplotlib figure."""
+        """Simulation plotter implementation. Renderes movements to a matplotlib figure.
+        The segments of all moves are collected in growable buffers. Only the segments that were
+        added since the last plot are rendered, as new line collection which is blitted onto
+        the figure. Therefore the time per plot doesn't depend on the size of the job."""
 
         def __init__(self, config, initial_lengh, physicsEngineClass, sim_speed, sim_plot_interval, non_drawing_moves):
-            self.points_x = []
-            self.points_y = []
-            self.points_x_nodraw = []
-            self.points_y_nodraw = []
-            self.pen_up_x = []
-            self.pen_up_y = []
-            self.pen_down_x = []
-            self.pen_down_y = []
+            self.segments = SegmentBuffer()
+            self.segments_nodraw = SegmentBuffer()
+            self.plotted = 0
+            self.plotted_nodraw = 0
             self.non_drawing_moves = non_drawing_moves
             self.sim_speed = sim_speed
             self.sim_plot_interval = sim_plot_interval
@@ -39,74 +38,87 @@ else:
 
         @overrides(plotter_base.BasePlotter)
         def moveToPos(self, targetPos):
+            targetPos = np.asarray(targetPos, dtype=np.float64)
             if self.penIsDown:
-                self.points_x.append(self.currPos[0] + self.calib.origin[0])
-                self.points_y.append(self.currPos[1] + self.calib.origin[1])
+                self.segments.add(self.currPos + self.calib.origin,
+                                  targetPos + self.calib.origin)
             elif self.non_drawing_moves:
-                self.points_x_nodraw.append(
-                    self.currPos[0] + self.calib.origin[0])
-                self.points_y_nodraw.append(
-                    self.currPos[1] + self.calib.origin[1])
+                self.segments_nodraw.add(self.currPos + self.calib.origin,
+                                         targetPos + self.calib.origin)
 
             self.currPos = targetPos
 
         @overrides(plotter_base.BasePlotter)
-        def penUp(self):
+        def moveArc(self, center, radius, startAngle, endAngle):
+            # Render the arc with the same sampling as the hardware plotter
+            points = sampleArc(
+                center, radius, startAngle, endAngle, self.calib.resolution)
+
+            self.moveToPos(points[0])
             if self.penIsDown:
-                self.points_x.append(self.currPos[0] + self.calib.origin[0])
-                self.points_y.append(self.currPos[1] + self.calib.origin[1])
-                self.points_x.append(np.nan)
-                self.points_y.append(np.nan)
-                self.pen_up_x.append(self.currPos[0] + self.calib.origin[0])
-                self.pen_up_y.append(self.currPos[1] + self.calib.origin[1])
+                self.segments.addPolyline(points + self.calib.origin)
             elif self.non_drawing_moves:
-                self.points_x_nodraw.append(
-                    self.currPos[0] + self.calib.origin[0])
-                self.points_y_nodraw.append(
-                    self.currPos[1] + self.calib.origin[1])
+                self.segments_nodraw.addPolyline(points + self.calib.origin)
+            self.currPos = points[-1]
 
+        @overrides(plotter_base.BasePlotter)
+        def penUp(self):
             self.penIsDown = False
 
         @overrides(plotter_base.BasePlotter)
         def penDown(self):
-            if not self.penIsDown:
-                self.points_x.append(self.currPos[0] + self.calib.origin[0])
-                self.points_y.append(self.currPos[1] + self.calib.origin[1])
-                self.pen_down_x.append(self.currPos[0] + self.calib.origin[0])
-                self.pen_down_y.append(self.currPos[1] + self.calib.origin[1])
-            elif self.non_drawing_moves:
-                self.points_x.append(self.currPos[0] + self.calib.origin[0])
-                self.points_y.append(self.currPos[1] + self.calib.origin[1])
-                self.points_x_nodraw.append(np.nan)
-                self.points_y_nodraw.append(np.nan)
-
             self.penIsDown = True
 
+        def initFigure(self):
+            """Opens the figure and draws the static parts: Motors, origin and the drawing area.
+            The figure is redrawn by the event loop (e.g. after resizing) and when plotting."""
+            self.fig, self.ax = plt.subplots()
+            self.ax.scatter(0, 0, 20, "g")
+            self.ax.scatter(self.calib.origin[0], self.calib.origin[1], 20, "g")
+            self.ax.plot([0, self.calib.base, self.calib.base, 0, 0],
+                         [0, 0, 700, 700, 0])
+            # The limits are fixed, otherwise all segments would have to be redrawn
+            self.ax.set_xlim(-10, self.calib.base + 10)
+            self.ax.set_ylim(710, -10)
+            self.ax.set_aspect('equal')
+            self.ax.autoscale(False)
+
+            plt.show(block=False)
+            self.fig.canvas.draw()
+            self.fig.canvas.flush_events()
+
         def plotCurrentState(self):
-            plt.cla()
-            if self.non_drawing_moves:
-                plt.plot(self.points_x_nodraw, self.points_y_nodraw, 'r')
-            plt.plot(self.points_x, self.points_y, 'b')
-            plt.scatter(0, 0, 20, "g")
-            plt.scatter(self.calib.origin[0], self.calib.origin[1], 20, "g")
-            plt.plot([0, self.calib.base, self.calib.base, 0, 0],
-                     [0, 0, 700, 700, 0])
-            # plt.scatter(self.pen_up_x,self.pen_up_y, 10,"m")
-            # plt.scatter(self.pen_down_x,self.pen_down_y, 10,"c")
-            plt.axis('equal')
-            plt.gca().invert_yaxis()
-            plt.draw()
-            plt.pause(self.sim_speed)
+            """Renders all segments that were added since the last plot."""
+            collections = []
+            if self.non_drawing_moves and len(self.segments_nodraw) > self.plotted_nodraw:
+                collections.append(LineCollection(
+                    self.segments_nodraw[self.plotted_nodraw:].copy(), colors='r', zorder=1))
+                self.plotted_nodraw = len(self.segments_nodraw)
+            if len(self.segments) > self.plotted:
+                collections.append(LineCollection(
+                    self.segments[self.plotted:].copy(), colors='b', zorder=2))
+                self.plotted = len(self.segments)
+
+            canvas = self.fig.canvas
+            for c in collections:
+                self.ax.add_collection(c, autolim=False)
+                self.ax.draw_artist(c)
+            if canvas.supports_blit:
+                canvas.blit(self.ax.bbox)
+            else:
+                canvas.draw_idle()
+            canvas.flush_events()
+            time.sleep(self.sim_speed)
 
         @overrides(plotter_base.BasePlotter)
         def processQueueAsync(self):
             print("Plotter thread started")
+            self.initFigure()
 
-            item = self.workerQueue.get()
             i = 0
             start = time.time()
-            while(item is not None):
-                self.executeCmd(item)
+            for item in self.iterQueue():
+                self.executeItem(item)
 
                 i += 1
                 if i % self.sim_plot_interval == 0:
@@ -114,8 +126,6 @@ else:
                           (i, (time.time() - start)*1000/i))
                     self.plotCurrentState()
 
-                item = self.workerQueue.get()
-
             self.plotCurrentState()
 
             plt.show(block=True)
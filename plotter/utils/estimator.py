@@ -0,0 +1,162 @@
+import numpy as np
+
+from plotter.utils.calibration import Calibration
+from plotter.utils.math import segmentCordLinear
+from plotter.utils.planner import MotionPlanner
+from plotter.utils.toolpath import Toolpath
+
+
+def cordSteps(physicsEngine, calib, points):
+    """Returns the absolute step positions (N,2) of both steppers at points (N,2),
+    relative to the home position."""
+    home = physicsEngine.point2CordLength(np.zeros((2,)))
+    return np.rint((physicsEngine.points2CordLengths(points) - home)*calib.stepsPerMM)
+
+
+def motorSteps(physicsEngine, calib, a, b):
+    """Returns the steps (N,2) both steppers execute on the straight lines a-b (N,2),
+    counting both directions, and the net steps (N,2) from a to b. A cord gets shorter
+    and longer again if the line passes the point closest to its motor."""
+    stepsA = cordSteps(physicsEngine, calib, a)
+    stepsB = cordSteps(physicsEngine, calib, b)
+    netSteps = stepsB - stepsA
+    steps = np.abs(netSteps)
+
+    ab = b - a
+    lenSq = np.maximum(np.sum(ab**2, axis=1), 1e-12)
+    motors = np.array([[0, 0], [calib.base, 0]]) - calib.origin
+    for i in range(2):
+        t = np.sum((motors[i] - a)*ab, axis=1)/lenSq
+        turn = np.nonzero((t > 0) & (t < 1))[0]
+        stepsTurn = cordSteps(physicsEngine, calib,
+                              a[turn] + t[turn, None]*ab[turn])[:, i]
+        steps[turn, i] = np.abs(stepsTurn - stepsA[turn, i]) + \
+            np.abs(stepsB[turn, i] - stepsTurn)
+    return steps, netSteps
+
+
+def plannedTimes(planner, steps, stroke, nominalSpeed):
+    """Returns the time of every move steps (N,2) (signed steps of both steppers) with the limits
+    of the motion planner. The steppers stop between strokes. Nominal speeds are measured in
+    steps per second of the dominant stepper."""
+    if steps.shape[0] == 0:
+        return np.zeros((0,))
+    length, acceleration, stopSpeed, junctionSpeed = planner.limits(steps)
+
+    # Max. speed at every junction
+    newStroke = np.ones((length.shape[0],), dtype=bool)
+    newStroke[1:] = stroke[1:] != stroke[:-1]
+    lastOfStroke = np.append(newStroke[1:], True)
+    maxEntry = np.minimum(nominalSpeed, stopSpeed)
+    maxEntry[1:] = np.where(newStroke[1:], maxEntry[1:], np.minimum(
+        junctionSpeed, np.minimum(nominalSpeed[1:], nominalSpeed[:-1])))
+    maxExit = np.where(lastOfStroke, np.minimum(nominalSpeed, stopSpeed),
+                       np.append(maxEntry[1:], 0))
+
+    # Both passes of the planner on squared speeds: The max. speed after accelerating over
+    # consecutive moves is a cumulative minimum of the prefix sums of their speed gains.
+    gain = np.concatenate(([0], np.cumsum(2*acceleration*length)))
+    nextEntry = np.append(np.where(lastOfStroke[:-1], np.inf, maxEntry[1:]**2), np.inf)
+    backward = np.minimum(maxExit**2, nextEntry) + gain[1:]
+    entrySq = np.minimum(maxEntry**2, np.minimum.accumulate(
+        backward[::-1])[::-1] - gain[:-1])
+    forward = np.minimum.accumulate(entrySq - gain[:-1]) + gain[1:]
+    exitSq = np.minimum(np.minimum(maxExit**2, forward), np.append(
+        np.where(lastOfStroke[:-1], np.inf, entrySq[1:]), np.inf))
+    entrySq[1:] = np.where(newStroke[1:], entrySq[1:],
+                           np.minimum(entrySq[1:], exitSq[:-1]))
+
+    entry, exit = np.sqrt(entrySq), np.sqrt(exitSq)
+    cruise, accelLength, cruiseLength, decelLength = MotionPlanner.trapezoid(
+        length, acceleration, entry, exit, nominalSpeed)
+    return (cruise - entry)/acceleration + (cruise - exit)/acceleration + cruiseLength/cruise
+
+
+def estimateJob(cmds, config, initial_lengh, PhysicsEngineClass):
+    """Estimates a job (parsed gcode commands, see parseGCode) on the hardware plotter without
+    executing it. Returns a dict with the drawing and travel distance (mm), the number of pen
+    lifts, the steps of both steppers and the estimated time (seconds) of drawing, travel and
+    servo moves.
+
+    The moves use the same kinematics, segmentation, step rate model (one step of the dominant
+    stepper per step delay) and acceleration limits as the hardware plotter. The look-ahead of
+    the motion planner is not limited to planner_lookahead moves, so the estimate is slightly
+    optimistic."""
+    base = config["base_width"]
+    calib = Calibration(base, PhysicsEngineClass.calcOrigin(initial_lengh, base),
+                        stepsPerMM=config["steps_per_mm"],
+                        resolution=config["movement_resolution"])
+    physicsEngine = PhysicsEngineClass(config, calib)
+    toolpath = Toolpath.fromCommands(cmds, calib.resolution)
+
+    # Segments of all strokes, every stroke starts at the end of the previous one.
+    # The segments are split like the moves of the hardware plotter (see segmentCordLinear).
+    strokeIndex = toolpath.strokeIndex()
+    inStroke = np.ones((toolpath.numPoints(),), dtype=bool)
+    inStroke[toolpath.offsets[:-1]] = False
+    points, _, parent = segmentCordLinear(
+        physicsEngine, toolpath.coords if toolpath.numPoints() > 0 else np.zeros((1, 2)),
+        config["movement_tolerance"], 1/calib.stepsPerMM, returnIndex=True)
+    segments = np.nonzero(inStroke[parent + 1])[0]
+    a, b = points[segments], points[segments + 1]
+    stroke = strokeIndex[parent[segments] + 1]
+    penDown = toolpath.penDown[stroke]
+    lengths = np.linalg.norm(b - a, axis=1)
+
+    steps, netSteps = motorSteps(physicsEngine, calib, a, b)
+    moving = np.any(steps > 0, axis=1)
+    stroke, penDown, lengths = stroke[moving], penDown[moving], lengths[moving]
+    steps, netSteps = steps[moving], netSteps[moving]
+
+    # Speed of every segment, strokes without speed use the last speed or the default speed
+    speed = toolpath.speed.copy()
+    idx = np.where(~np.isnan(speed), np.arange(speed.shape[0]), -1)
+    np.maximum.accumulate(idx, out=idx)
+    speed = np.where(idx >= 0, speed[np.maximum(idx, 0)], 10000)[stroke]
+    nominalSpeed = speed/config["micro_stepping"]
+
+    planner = MotionPlanner(config, calib.stepsPerMM)
+    times = plannedTimes(planner, steps*np.where(netSteps < 0, -1, 1),
+                         stroke, nominalSpeed)
+
+    # Servo moves. The pen-up settle time overlaps with the following travel.
+    strokeTimes = np.bincount(stroke, times, len(toolpath))
+    strokePen = toolpath.penDown
+    changes = np.nonzero(strokePen != np.concatenate(([False], strokePen[:-1])))[0]
+    downs = changes[strokePen[changes]]
+    ups = changes[~strokePen[changes]]
+    travelDelay = min(config["servo_travel_delay"], config["servo_settle_up"])
+    servoTime = downs.shape[0]*config["servo_settle_down"] + ups.shape[0]*travelDelay + \
+        np.sum(np.maximum(config["servo_settle_up"] - travelDelay - strokeTimes[ups], 0))
+
+    return {"drawDistance": np.sum(lengths[penDown]),
+            "travelDistance": np.sum(lengths[~penDown]),
+            "penLifts": ups.shape[0],
+            "steps": np.sum(steps, axis=0),
+            "drawTime": np.sum(times[penDown]),
+            "travelTime": np.sum(times[~penDown]),
+            "servoTime": servoTime,
+            "naiveTime": np.sum(np.max(steps, axis=1)/nominalSpeed) if steps.shape[0] > 0 else 0,
+            "totalTime": np.sum(times) + servoTime}
+
+
+def formatEstimate(estimate):
+    """Returns a printable report of a job estimate (see estimateJob)."""
+    def duration(t):
+        t = round(t, 1)
+        return "%d:%02d:%04.1f" % (t//3600, t//60 % 60, t % 60)
+    return """------------ Estimate ------------
+Drawing distance:  {:.1f} m
+Travel distance:   {:.1f} m
+Pen lifts:         {}
+Steps per motor:   {} {}
+Drawing time:      {}
+Travel time:       {}
+Servo time:        {}
+Total time:        {} (without acceleration limits and servo: {})
+----------------------------------""".format(
+        estimate["drawDistance"]/1000, estimate["travelDistance"]/1000, estimate["penLifts"],
+        int(estimate["steps"][0]), int(estimate["steps"][1]),
+        duration(estimate["drawTime"]), duration(estimate["travelTime"]),
+        duration(estimate["servoTime"]), duration(estimate["totalTime"]),
+        duration(estimate["naiveTime"]))
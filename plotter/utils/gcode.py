@@ -1,5 +1,8 @@
+import itertools
 import numpy as np
 
+from plotter.utils.math import simplifyPolylines
+
 
 def GCode_goTo(p, s=None):
     """Generate gcode to move to position p(x,y) with optional speed s."""
@@ -9,6 +12,15 @@ def GCode_goTo(p, s=None):
         return "G0 X%f Y%f" % (p[0], p[1])
 
 
+def GCode_arc(c, r, a, b, s=None):
+    """Generate gcode to move on an arc around center c(x,y) with radius r
+    from angle a to angle b (degrees) with optional speed s."""
+    if s is not None:
+        return "G2 X%f Y%f R%f A%f B%f S%f" % (c[0], c[1], r, a, b, s)
+    else:
+        return "G2 X%f Y%f R%f A%f B%f" % (c[0], c[1], r, a, b)
+
+
 def GCode_home():
     """Go to homing position (0,0)."""
     return "G28"
@@ -40,17 +52,267 @@ def decodeGCode(gcode):
     return data
 
 
-def postProcessGCode(gcode, minSegmentLen=1):
-    """Postprocesses a gcode file (list of string commands). 
-    Removes all movements smaller than minSegmentLen and noop commands."""
-    init_size = len(gcode)
-    gcode_old = gcode
-    gcode_curr = []
+# Parameters of the bulk parser, in the order they are written
+GCODE_PARAMS = "XYRABS"
+
+# Record of a single command, parsed by parseGCode
+GCODE_DTYPE = np.dtype([("code", "S8")] +
+                       [(k, np.float64) for k in GCODE_PARAMS] +
+                       [("has" + k, np.bool_) for k in GCODE_PARAMS])
+
+def parseGCode(text):
+    """Parses a gcode file or a chunk of it (str or bytes) in a single pass.
+    Returns a structured array (see GCODE_DTYPE) with one record per command.
+    Empty lines are skipped, missing parameters are 0 with a has<Param> flag of False.
+    Lines with invalid parameters are skipped with a warning, like in decodeGCode.
+    The warning contains the line number (counted from the start of text) and the invalid parameter."""
+    if isinstance(text, str):
+        text = text.encode()
+    buf = np.frombuffer(text, dtype=np.uint8)
+
+    # Find all tokens and their line
+    space = buf <= ord(" ")
+    tokenStart = np.flatnonzero(~space & np.concatenate(([True], space[:-1])))
+    tokenEnd = np.flatnonzero(~space & np.concatenate((space[1:], [True]))) + 1
+    line = np.searchsorted(np.flatnonzero(buf == ord("\n")), tokenStart)
+    isCode = np.ones(tokenStart.shape, dtype=bool)
+    isCode[1:] = line[1:] != line[:-1]
+
+    # The first token of a line is the command, one record per non-empty line
+    codeStart, codeLen = tokenStart[isCode], tokenEnd[isCode] - tokenStart[isCode]
+    cmds = np.zeros((codeStart.shape[0],), dtype=GCODE_DTYPE)
+    codeSize = GCODE_DTYPE["code"].itemsize
+    padded = np.concatenate((buf, np.zeros((codeSize,), dtype=np.uint8)))
+    codeBytes = padded[codeStart[:, None] + np.arange(codeSize)]
+    codeBytes[np.arange(codeSize) >= codeLen[:, None]] = 0
+    cmds["code"] = codeBytes.view("S%d" % codeSize)[:, 0]
+
+    # Parameters are a single letter followed by a number,
+    # parse all numbers at once after blanking commands and letters
+    row = np.cumsum(isCode) - 1
+    paramStart, paramEnd, paramRow = tokenStart[~isCode], tokenEnd[~isCode], row[~isCode]
+    numbers = buf.copy()
+    numbers[paramStart] = ord(" ")
+    for i in range(codeLen.max(initial=0)):
+        numbers[codeStart[codeLen > i] + i] = ord(" ")
+    try:
+        values = np.fromstring(numbers.tobytes().decode(), sep=" ")
+    except ValueError:
+        values = np.zeros((0,))
+
+    valid = np.ones((cmds.shape[0],), dtype=bool)
+    if values.shape[0] != paramStart.shape[0]:
+        # Slow path, find the invalid values
+        values = np.zeros((paramStart.shape[0],))
+        paramLine = line[~isCode]
+        for i, (s, e) in enumerate(zip(paramStart.tolist(), paramEnd.tolist())):
+            try:
+                values[i] = float(text[s + 1:e])
+            except ValueError:
+                print("Failed to decode command in line %d: %s" %
+                      (paramLine[i] + 1, text[s:e].decode(errors="replace")))
+                valid[paramRow[i]] = False
+
+    letters = buf[paramStart]
+    for k in GCODE_PARAMS:
+        sel = letters == ord(k)
+        cmds[k][paramRow[sel]] = values[sel]
+        cmds["has" + k][paramRow[sel]] = True
+
+    return cmds[valid]
+
+
+def readGCodeFile(file_name):
+    """Parses a whole gcode file with parseGCode."""
+    with open(file_name, 'rb') as f:
+        return parseGCode(f.read())
+
+
+def formatGCode(cmds):
+    """Renders an array of commands (see GCODE_DTYPE) as gcode with one command per line.
+    Parameters are written as in GCode_goTo and GCode_arc, so generated gcode
+    is reproduced exactly."""
+    if cmds.shape[0] == 0:
+        return ""
+
+    has = np.stack([cmds["has" + k] for k in GCODE_PARAMS], axis=1)
+    values = np.stack([cmds[k] for k in GCODE_PARAMS], axis=1)
+
+    # One format string per distinct combination of command and parameters
+    codes, codeIdx = np.unique(cmds["code"].view(np.uint64), return_inverse=True)
+    flags = np.packbits(has, axis=1, bitorder='little')[:, 0]
+    keys, inverse = np.unique(codeIdx.ravel()*256 + flags, return_inverse=True)
+    codes = codes.view("S%d" % GCODE_DTYPE["code"].itemsize)
+    formats = np.array([codes[key >> 8].decode().replace("%", "%%") +
+                        "".join(" %s%%f" % k for i, k in enumerate(GCODE_PARAMS)
+                                if key & (1 << i))
+                        for key in keys.tolist()], dtype=object)
+
+    # Format all values at once
+    return "\n".join(formats[inverse.ravel()].tolist()) % tuple(values[has].tolist())
+
+
+def sampleArc(center, radius, startAngle, endAngle, maxSegmentLen):
+    """Samples an arc with segments that are not longer than maxSegmentLen.
+    Angles are specified in degrees and measured from the x towards the y axis.
+    Returns an array of points (N,2), including the start and end point."""
+    sweep = np.radians(endAngle - startAngle)
+    n = max(int(np.ceil(np.abs(sweep)*radius/maxSegmentLen)), 1)
+    a = np.radians(startAngle) + np.linspace(0, sweep, n + 1)
+    return np.stack((center[0] + radius*np.cos(a),
+                     center[1] + radius*np.sin(a)), axis=1)
+
+
+def arcEndPoint(d):
+    """Returns the end point of a decoded G2 command."""
+    end = np.radians(d.get("B", 360))
+    return np.array([d["X"] + d["R"]*np.cos(end),
+                     d["Y"] + d["R"]*np.sin(end)])
+
+
+def iterCommands(gcode):
+    """Iterates over all commands of a gcode stream. The stream may contain
+    single commands (strings) as well as chunks (lists) of commands."""
+    for c in gcode:
+        if isinstance(c, str):
+            yield c
+        else:
+            yield from c
+
+
+def writeGCode(gcode, file_name, chunkSize=10000):
+    """Writes a gcode stream to a file, chunkSize commands at a time."""
+    gcode = iter(gcode)
+    with open(file_name, 'w') as f:
+        separator = ""
+        chunk = list(itertools.islice(gcode, chunkSize))
+        while len(chunk) > 0:
+            f.write(separator + "\n".join(chunk))
+            separator = "\n"
+            chunk = list(itertools.islice(gcode, chunkSize))
+
+
+# Header of binary job files: Magic, version and size of a single record
+JOB_HEADER = np.dtype([("magic", "S3"), ("version", np.uint8), ("recordSize", np.uint32),
+                       ("reserved", np.uint64)])
+JOB_MAGIC = b"VPJ"
+JOB_VERSION = 2
+
+# Commands of job files, stored as index + 1 (0 for unknown commands)
+JOB_CODES = [b"G0", b"G2", b"G28", b"M3", b"M4"]
+# Flags of a pen command (M3 or M4) which is executed before the command of a record
+JOB_PEN_DOWN = 1 << len(GCODE_PARAMS)
+JOB_PEN_UP = 2 << len(GCODE_PARAMS)
+
+# Compact record of a single command in a job file.
+# flags: Bit i is set if the command has parameter GCODE_PARAMS[i],
+#        JOB_PEN_DOWN/JOB_PEN_UP if the command is preceded by a pen command
+# values: Parameters in the order of GCODE_PARAMS, 0 if missing
+JOB_DTYPE = np.dtype([("code", np.uint8), ("flags", np.uint8),
+                      ("values", np.float32, (len(GCODE_PARAMS),))])
+
+
+def encodeJobRecords(cmds):
+    """Converts parsed commands (see GCODE_DTYPE) into job file records (see JOB_DTYPE).
+    A pen command which is followed by any other command is merged into the record of that
+    command. Parameters are stored with single precision, which resolves 0.1 um at plotter scale."""
+    code = np.zeros(cmds.shape, dtype=np.uint8)
+    for i, c in enumerate(JOB_CODES):
+        code[cmds["code"] == c] = i + 1
+    has = np.stack([cmds["has" + k] for k in GCODE_PARAMS], axis=1)
+    flags = np.packbits(has, axis=1, bitorder='little')[:, 0]
+
+    isPen = (code == JOB_CODES.index(b"M3") + 1) | (code == JOB_CODES.index(b"M4") + 1)
+    merged = np.zeros(cmds.shape, dtype=bool)
+    merged[:-1] = isPen[:-1] & ~isPen[1:]
+    penFlags = np.where(code[:-1] == JOB_CODES.index(b"M3") + 1, JOB_PEN_DOWN, JOB_PEN_UP)
+    flags[1:] |= np.where(merged[:-1], penFlags, 0).astype(np.uint8)
+
+    keep = ~merged
+    records = np.zeros((np.count_nonzero(keep),), dtype=JOB_DTYPE)
+    records["code"] = code[keep]
+    records["flags"] = flags[keep]
+    records["values"] = np.stack([cmds[k][keep] for k in GCODE_PARAMS], axis=1)
+    return records
+
+
+def decodeJobRecords(records):
+    """Converts job file records (see JOB_DTYPE) into parsed commands (see GCODE_DTYPE)."""
+    flags = records["flags"]
+    pen = (flags & (JOB_PEN_DOWN | JOB_PEN_UP)) != 0
+    index = np.arange(records.shape[0]) + np.cumsum(pen)
+    cmds = np.zeros((records.shape[0] + np.count_nonzero(pen),), dtype=GCODE_DTYPE)
+
+    codes = np.array([b""] + JOB_CODES, dtype=GCODE_DTYPE["code"])
+    cmds["code"][index] = codes[records["code"]]
+    cmds["code"][index[pen] - 1] = np.where(flags[pen] & JOB_PEN_DOWN, b"M3", b"M4")
+    values = records["values"]
+    for i, k in enumerate(GCODE_PARAMS):
+        cmds[k][index] = values[:, i]
+        cmds["has" + k][index] = (flags >> i) & 1
+    return cmds
+
+
+def writeJob(gcode, file_name, chunkSize=10000):
+    """Writes a gcode stream to a binary job file (.vpj), chunkSize commands at a time.
+    A job file consists of a small header followed by the parsed commands as compact fixed
+    size records (see JOB_DTYPE), so it can be memory mapped by the plotter.
+    Commands other than JOB_CODES can't be stored and are executed as unknown commands."""
+    gcode = iter(gcode)
+    with open(file_name, 'wb') as f:
+        header = np.zeros((1,), dtype=JOB_HEADER)
+        header["magic"] = JOB_MAGIC
+        header["version"] = JOB_VERSION
+        header["recordSize"] = JOB_DTYPE.itemsize
+        header.tofile(f)
+
+        chunk = list(itertools.islice(gcode, chunkSize))
+        while len(chunk) > 0:
+            encodeJobRecords(parseGCode("\n".join(chunk))).tofile(f)
+            chunk = list(itertools.islice(gcode, chunkSize))
+
+
+def numJobRecords(file_name):
+    """Validates the header of a binary job file and returns the number of records."""
+    header = np.fromfile(file_name, dtype=JOB_HEADER, count=1)
+    if header.shape[0] != 1 or header["magic"][0] != JOB_MAGIC or \
+            header["version"][0] != JOB_VERSION or \
+            header["recordSize"][0] != JOB_DTYPE.itemsize:
+        raise ValueError("Invalid job file: " + file_name)
+
+    with open(file_name, 'rb') as f:
+        f.seek(0, 2)
+        return (f.tell() - JOB_HEADER.itemsize) // JOB_DTYPE.itemsize
+
+
+def openJob(file_name, start=0, count=None):
+    """Memory maps the records of a binary job file and returns their commands
+    (see GCODE_DTYPE). Optionally, only count records beginning at record start are read."""
+    numRecords = numJobRecords(file_name)
+    start = min(start, numRecords)
+    count = numRecords - start if count is None else min(count, numRecords - start)
+    if count == 0:
+        # Empty files can not be mapped
+        return np.zeros((0,), dtype=GCODE_DTYPE)
+
+    records = np.memmap(file_name, dtype=JOB_DTYPE, mode='r', shape=(count,),
+                        offset=JOB_HEADER.itemsize + start*JOB_DTYPE.itemsize)
+    return decodeJobRecords(records)
+
+
+def iterJob(file_name, chunkSize=65536):
+    """Iterates over the commands of a binary job file in chunks of chunkSize records
+    (see openJob). Each chunk is mapped and decoded when it is requested, so the resident
+    memory does not depend on the size of the job."""
+    for start in range(0, numJobRecords(file_name), chunkSize):
+        yield openJob(file_name, start, chunkSize)
+
+
+def removeShortMoves(gcode, minSegmentLen=1):
+    """Removes all movements smaller than minSegmentLen from a gcode stream."""
     pos = None
-    xRange = [np.iinfo(int).max, 0]
-    yRange = [np.iinfo(int).max, 0]
 
-    for code in gcode_old:
+    for code in gcode:
         if code.startswith("G0"):
 
             d = decodeGCode(code)
@@ -66,23 +328,93 @@ def postProcessGCode(gcode, minSegmentLen=1):
         elif code.startswith("G28"):
             pos = np.array([0, 0])
 
-        gcode_curr.append(code)
+        elif code.startswith("G2 "):
+            # Arcs are never skipped, continue at the end of the arc
+            pos = arcEndPoint(decodeGCode(code))
+
+        yield code
 
-    gcode_old = list(gcode_curr)
-    gcode_curr = []
+
+def simplifyGCode(gcode, tolerance):
+    """Simplifies consecutive moves of a gcode stream with the Ramer-Douglas-Peucker
+    algorithm. Removed points are closer than tolerance to the simplified path.
+    Only one run of consecutive moves is buffered at a time."""
+    pos = np.zeros((2,))
+    speed = None
+    run = []
+    points = []
+    keep = []
+
+    def flush():
+        if len(run) > 1:
+            mask = simplifyPolylines(np.array([pos] + points), [0, len(run) + 1],
+                                     tolerance, np.array([True] + keep))
+            return [c for c, k in zip(run, mask[1:]) if k]
+        return run
+
+    for code in gcode:
+        if code.startswith("G0"):
+            d = decodeGCode(code)
+            if d:
+                # Moves that change the speed are always kept
+                keep.append("S" in d and d["S"] != speed)
+                speed = d.get("S", speed)
+
+                last = points[-1] if len(points) > 0 else pos
+                points.append([d.get("X", last[0]), d.get("Y", last[1])])
+                run.append(code)
+                continue
+
+        yield from flush()
+        if len(points) > 0:
+            pos = np.array(points[-1])
+        run, points, keep = [], [], []
+
+        if code.startswith("G28"):
+            pos = np.zeros((2,))
+        elif code.startswith("G2 "):
+            d = decodeGCode(code)
+            pos = arcEndPoint(d)
+            speed = d.get("S", speed)
+
+        yield code
+
+    yield from flush()
+
+
+def postProcessGCode(gcode, minSegmentLen=1, simplifyTolerance=0):
+    """Postprocesses a gcode stream (iterable of string commands).
+    Simplifies the path if simplifyTolerance is > 0 (see simplifyGCode).
+    Removes all movements smaller than minSegmentLen and noop commands.
+    The stream is processed lazily, command by command, while the result is iterated."""
+    init_size = 0
+    size = 0
+    xRange = [np.iinfo(int).max, 0]
+    yRange = [np.iinfo(int).max, 0]
+
+    def countInput(gcode):
+        nonlocal init_size
+        for code in gcode:
+            init_size += 1
+            yield code
 
     penDownCurr = None
     penDownNext = None
 
-    for code in gcode_old:
-        if code.startswith("G0"):
+    gcode = countInput(gcode)
+    if simplifyTolerance > 0:
+        gcode = simplifyGCode(gcode, simplifyTolerance)
+
+    for code in removeShortMoves(gcode, minSegmentLen):
+        if code.startswith("G0") or code.startswith("G2 "):
             if penDownCurr is None:
                 if penDownNext is not None:
 
                     if penDownNext:
-                        gcode_curr.append(GCode_down())
+                        yield GCode_down()
                     else:
-                        gcode_curr.append(GCode_up())
+                        yield GCode_up()
+                    size += 1
 
                     penDownCurr = penDownNext
                 else:
@@ -93,22 +425,34 @@ def postProcessGCode(gcode, minSegmentLen=1):
             else:
                 if penDownCurr != penDownNext:
                     if penDownNext:
-                        gcode_curr.append(GCode_down())
+                        yield GCode_down()
                     else:
-                        gcode_curr.append(GCode_up())
+                        yield GCode_up()
+                    size += 1
 
                     penDownCurr = penDownNext
 
-            gcode_curr.append(code)
+            yield code
+            size += 1
 
             # Find out bounding box of model
             d = decodeGCode(code)
-            if "X" in d:
+            if "R" in d:
+                # Arc extremes are at its end points and at
+                # all multiples of 90 degrees in between
+                a, b = sorted([d.get("A", 0), d.get("B", 360)])
+                angles = np.radians(np.concatenate(
+                    ([a, b], np.arange(np.ceil(a/90), np.floor(b/90) + 1)*90)))
+                xs = d["X"] + d["R"]*np.cos(angles)
+                ys = d["Y"] + d["R"]*np.sin(angles)
+                xRange = [min(xRange[0], xs.min()), max(xRange[1], xs.max())]
+                yRange = [min(yRange[0], ys.min()), max(yRange[1], ys.max())]
+            elif "X" in d:
                 if d["X"] < xRange[0]:
                     xRange[0] = d["X"]
                 elif d["X"] > xRange[1]:
                     xRange[1] = d["X"]
-            if "Y" in d:
+            if "Y" in d and "R" not in d:
                 if d["Y"] < yRange[0]:
                     yRange[0] = d["Y"]
                 elif d["Y"] > yRange[1]:
@@ -119,10 +463,10 @@ def postProcessGCode(gcode, minSegmentLen=1):
         elif code.startswith("M4"):
             penDownNext = False
         else:
-            gcode_curr.append(code)
+            yield code
+            size += 1
 
     print("Reduced size from %d to %d lines of code. " %
-          (init_size, len(gcode_curr)))
+          (init_size, size))
     print("Model bounding box is (%f, %f) x (%f, %f) mm. " %
           (xRange[0], yRange[0], xRange[1], yRange[1]))
-    return gcode_curr
@@ -21,6 +21,32 @@ class PhysicsEngine:
         """
         raise NotImplementedError()
 
+    def cordLength2Point(self, l):
+        """Converts the left and right string length into a point in plotter coordinates
+           (forward kinematics).
+        """
+        raise NotImplementedError()
+
+    def points2CordLengths(self, points):
+        """Converts an array of points (N,2) into an array of string lengths (N,2).
+           Falls back to point2CordLength, override this with a vectorized implementation.
+        """
+        points = np.reshape(points, (-1, 2))
+        lengths = np.empty(points.shape)
+        for i, p in enumerate(points):
+            lengths[i] = self.point2CordLength(p)
+        return lengths
+
+    def cordLengths2Points(self, lengths):
+        """Converts an array of string lengths (N,2) into an array of points (N,2).
+           Falls back to cordLength2Point, override this with a vectorized implementation.
+        """
+        lengths = np.reshape(lengths, (-1, 2))
+        points = np.empty(lengths.shape)
+        for i, l in enumerate(lengths):
+            points[i] = self.cordLength2Point(l)
+        return points
+
 
 class SimplePhysicsEngine(PhysicsEngine):
     """Most simple implementation. Assumes pen location at print head center
@@ -50,3 +76,126 @@ class SimplePhysicsEngine(PhysicsEngine):
         l1 = np.sqrt(p_[0]**2 + p_[1]**2)
         l2 = np.sqrt((self.calib.base - p_[0])**2 + p_[1]**2)
         return np.array((l1, l2))
+
+    def cordLength2Point(self, l):
+        """Converts the left and right string length into a point in plotter coordinates.
+        """
+        return self.cordLengths2Points(l)[0]
+
+    def points2CordLengths(self, points):
+        """Converts an array of points (N,2) into an array of string lengths (N,2).
+        """
+        p_ = np.reshape(points, (-1, 2)) + self.calib.origin
+        lengths = np.empty(p_.shape)
+        y2 = p_[:, 1]**2
+        np.sqrt(p_[:, 0]**2 + y2, out=lengths[:, 0])
+        np.sqrt((self.calib.base - p_[:, 0])**2 + y2, out=lengths[:, 1])
+        return lengths
+
+    def cordLengths2Points(self, lengths):
+        """Converts an array of string lengths (N,2) into an array of points (N,2).
+           The point is the intersection of the two circles around the motors (below the motors).
+        """
+        l = np.reshape(lengths, (-1, 2))
+        base = self.calib.base
+        points = np.empty(l.shape)
+        points[:, 0] = (base**2 + l[:, 0]**2 - l[:, 1]**2)/(2*base)
+        points[:, 1] = np.sqrt(np.maximum(l[:, 0]**2 - points[:, 0]**2, 0))
+        return points - self.calib.origin
+
+
+def pointSegmentDistance(p, a, b):
+    """Returns the distance of points p to the line segments a-b (all (N,2) arrays)."""
+    ab = b - a
+    ap = p - a
+    lenSq = np.sum(ab**2, axis=1)
+    t = np.clip(np.sum(ap*ab, axis=1)/np.where(lenSq > 0, lenSq, 1), 0, 1)
+    return np.linalg.norm(ap - t[:, None]*ab, axis=1)
+
+
+def simplifyPolylines(coords, offsets, tolerance, keep=None):
+    """Ramer-Douglas-Peucker simplification of multiple polylines at once.
+    Polyline i consists of the points coords[offsets[i]:offsets[i+1]].
+    Each iteration splits all intervals of all polylines in parallel, until every removed
+    point is closer than tolerance to its simplified segment.
+    Points that are set in the optional keep mask are always kept.
+    Returns a boolean mask of the points that are kept."""
+    offsets = np.asarray(offsets)
+    if keep is None:
+        keep = np.zeros((coords.shape[0],), dtype=bool)
+    else:
+        keep = keep.copy()
+    keep[offsets[:-1]] = True
+    keep[offsets[1:] - 1] = True
+
+    candidates = np.nonzero(~keep)[0]
+    while candidates.shape[0] > 0:
+        # Interval (kept neighbors) of each candidate
+        kept = np.nonzero(keep)[0]
+        right = np.searchsorted(kept, candidates)
+        a, b = kept[right - 1], kept[right]
+        dist = pointSegmentDistance(coords[candidates], coords[a], coords[b])
+
+        # Max. distance per interval, candidates of an interval are contiguous
+        first = np.nonzero(np.concatenate(([True], a[1:] != a[:-1])))[0]
+        interval = np.repeat(np.arange(first.shape[0]),
+                             np.diff(np.append(first, candidates.shape[0])))
+        maxDist = np.maximum.reduceat(dist, first)
+
+        # Split intervals at their farthest point if it is too far away
+        split = maxDist > tolerance
+        isMax = np.nonzero(dist == maxDist[interval])[0]
+        _, firstMax = np.unique(interval[isMax], return_index=True)
+        splitAt = isMax[firstMax][split]
+        keep[candidates[splitAt]] = True
+
+        candidates = candidates[split[interval]]
+        candidates = candidates[~keep[candidates]]
+
+    return keep
+
+
+def segmentCordLinear(physicsEngine, points, tolerance, minSegmentLen=0.01, returnIndex=False):
+    """Adaptive segmentation of the polyline points (N,2) for moves which interpolate
+    the cord lengths linearly between two points.
+    The pen doesn't follow a straight line during such a move. Each iteration bisects all
+    segments in parallel whose deviation from the straight line exceeds tolerance (mm).
+    The path of a move can be S-shaped with a small deviation in the middle, so the deviation
+    is sampled at 7 equidistant cord lengths between both points. The max. deviation between
+    the samples might exceed the tolerance slightly.
+    Segments shorter than minSegmentLen are never split.
+    Returns the segmented points (M,2) and their cord lengths (M,2). If returnIndex is True,
+    the index (M-1,) of the input segment of every segment is returned as well."""
+    points = np.asarray(points, dtype=np.float64)
+    lengths = physicsEngine.points2CordLengths(points)
+    index = np.arange(points.shape[0] - 1)
+    check = np.ones((points.shape[0] - 1,), dtype=bool)
+
+    while np.any(check):
+        segments = np.nonzero(check)[0]
+        a, b = points[segments], points[segments + 1]
+        t = np.arange(1, 8)[:, None, None]/8
+        p = physicsEngine.cordLengths2Points(
+            (1 - t)*lengths[segments] + t*lengths[segments + 1])
+        dist = np.max(pointSegmentDistance(p, np.tile(a, (7, 1)), np.tile(b, (7, 1)))
+                      .reshape(7, -1), axis=0)
+
+        split = (dist > tolerance) & \
+            (np.linalg.norm(b - a, axis=1) >= 2*minSegmentLen)
+        segments = segments[split]
+        newPoints = (points[segments] + points[segments + 1])/2
+        newLengths = physicsEngine.points2CordLengths(newPoints)
+
+        # Both halves of a split segment are checked again
+        points = np.insert(points, segments + 1, newPoints, axis=0)
+        lengths = np.insert(lengths, segments + 1, newLengths, axis=0)
+        if returnIndex:
+            index = np.insert(index, segments + 1, index[segments])
+        check = np.zeros((points.shape[0] - 1,), dtype=bool)
+        halves = segments + np.arange(segments.shape[0])
+        check[halves] = True
+        check[halves + 1] = True
+
+    if returnIndex:
+        return points, lengths, index
+    return points, lengths
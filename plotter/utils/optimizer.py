@@ -0,0 +1,318 @@
+import math
+import time
+import numpy as np
+from scipy.spatial import cKDTree
+
+from plotter.utils.toolpath import Toolpath
+
+
+def travelDistance(starts, ends, home=(0, 0)):
+    """Returns the pen-up distance when drawing strokes with the given start and end
+    points in order, beginning at the home position."""
+    if starts.shape[0] == 0:
+        return 0.0
+    prevEnds = np.concatenate(([home], ends[:-1]))
+    return float(np.sum(np.linalg.norm(starts - prevEnds, axis=1)))
+
+
+def greedyOrder(starts, ends, home=(0, 0)):
+    """Orders strokes by always drawing the closest remaining stroke next.
+    Strokes might be reversed, if their end point is closer than their start point.
+    Returns the order and a boolean array which indicates reversed strokes."""
+    n = starts.shape[0]
+    # Endpoint 2*i is the start of stroke i, endpoint 2*i+1 its end
+    endpoints = np.empty((2*n, 2))
+    endpoints[0::2] = starts
+    endpoints[1::2] = ends
+
+    alive = np.ones((n,), dtype=bool)
+    treeIds = np.arange(2*n)
+    tree = cKDTree(endpoints)
+
+    order = np.empty((n,), dtype=np.int64)
+    reverse = np.empty((n,), dtype=bool)
+    cur = np.asarray(home, dtype=np.float64)
+
+    for step in range(n):
+        k = 16
+        while True:
+            k = min(k, treeIds.shape[0])
+            _, idx = tree.query(cur, k=k)
+            ids = treeIds[np.atleast_1d(idx)]
+            hits = np.nonzero(alive[ids >> 1])[0]
+            if hits.shape[0] > 0 or k == treeIds.shape[0]:
+                break
+            k *= 4
+
+        e = ids[hits[0]]
+        order[step] = e >> 1
+        reverse[step] = e & 1
+        alive[e >> 1] = False
+        cur = endpoints[e ^ 1]
+
+        # Most of the tree consists of drawn strokes, rebuild it
+        remaining = n - step - 1
+        if remaining > 0 and 4*remaining < treeIds.shape[0]:
+            treeIds = np.nonzero(np.repeat(alive, 2))[0]
+            tree = cKDTree(endpoints[treeIds])
+
+    return order, reverse
+
+
+def twoOptImprove(starts, ends, order, reverse, timeLimit, home=(0, 0), neighbors=8):
+    """Improves a stroke order with 2-opt moves until no move improves the travel
+    distance or the time limit (seconds) is reached. A move reverses a block of
+    strokes, including the direction of each stroke in the block.
+    Only moves which connect an endpoint to one of its nearest neighbors are tested."""
+    deadline = time.time() + timeLimit
+    n = order.shape[0]
+    if n < 3:
+        return order, reverse
+
+    # Position 0 is a virtual stroke at the home position
+    endpoints = np.empty((2*n + 2, 2))
+    endpoints[0:2*n:2] = starts
+    endpoints[1:2*n:2] = ends
+    endpoints[2*n:] = home
+    nb = cKDTree(endpoints).query(endpoints, k=neighbors + 1)[1].tolist()
+
+    order = [n] + order.tolist()
+    flipped = [False] + reverse.tolist()
+    pos = [0]*(n + 1)
+    for i, s in enumerate(order):
+        pos[s] = i
+
+    def point(s, f, end):
+        # Current start (end=False) or end point of stroke s
+        return endpoints[2*s + (end != f)]
+    sx, sy = [], []
+    ex, ey = [], []
+    for s, f in zip(order, flipped):
+        p, q = point(s, f, False), point(s, f, True)
+        sx.append(float(p[0]))
+        sy.append(float(p[1]))
+        ex.append(float(q[0]))
+        ey.append(float(q[1]))
+
+    def gain(a, b):
+        # Travel saved by reversing the block a+1 ... b
+        d = math.hypot(ex[a] - sx[a+1], ey[a] - sy[a+1]) - \
+            math.hypot(ex[a] - ex[b], ey[a] - ey[b])
+        if b < n:
+            d += math.hypot(ex[b] - sx[b+1], ey[b] - sy[b+1]) - \
+                math.hypot(sx[a+1] - sx[b+1], sy[a+1] - sy[b+1])
+        return d
+
+    def apply(a, b):
+        blk = slice(a+1, b+1)
+        sx[blk], ex[blk] = ex[blk][::-1], sx[blk][::-1]
+        sy[blk], ey[blk] = ey[blk][::-1], sy[blk][::-1]
+        order[blk] = order[blk][::-1]
+        flipped[blk] = [not f for f in flipped[blk][::-1]]
+        for k in range(a+1, b+1):
+            pos[order[k]] = k
+
+    def improveAt(i):
+        # Candidates: strokes whose current end is close to the end of i,
+        # or whose current start is close to the start of i
+        s = order[i]
+        for end in (True, False):
+            if not end and i == 0:
+                continue
+            for q in nb[2*s + (end != flipped[i])]:
+                t = q >> 1
+                if t == s or t == n:
+                    continue
+                j = pos[t]
+                # Is q the matching end of t ?
+                if ((q & 1) == 1) != (end != flipped[j]):
+                    continue
+                if end:
+                    a, b = min(i, j), max(i, j)
+                else:
+                    a, b = min(i, j) - 1, max(i, j) - 1
+                if a < b and gain(a, b) > 1e-9:
+                    apply(a, b)
+                    return True
+        return False
+
+    improved = True
+    while improved and time.time() < deadline:
+        improved = False
+        for i in range(n + 1):
+            if improveAt(i):
+                improved = True
+            if time.time() >= deadline:
+                break
+
+    return np.array(order[1:], dtype=np.int64), np.array(flipped[1:], dtype=bool)
+
+
+def optimizeStrokeOrder(toolpath, travelSpeed, timeLimit=10.0):
+    """Reorders (and possibly reverses) all drawing strokes of a toolpath to minimize the
+    pen-up travel distance. Uses a greedy nearest neighbor ordering followed by a
+    time-boxed (seconds) 2-opt improvement. Pen-up strokes are replaced by direct
+    travel moves with speed travelSpeed."""
+    draw = toolpath.select(np.nonzero(toolpath.penDown)[0])
+    starts, ends = draw.startPoints(), draw.endPoints()
+    n = len(draw)
+
+    before = travelDistance(starts, ends)
+    start = time.time()
+    order, reverse = greedyOrder(starts, ends)
+    greedy = travelDistance(np.where(reverse[:, None], ends[order], starts[order]),
+                            np.where(reverse[:, None], starts[order], ends[order]))
+    order, reverse = twoOptImprove(starts, ends, order, reverse, timeLimit)
+    draw = draw.select(order, reverse)
+    starts, ends = draw.startPoints(), draw.endPoints()
+    after = travelDistance(starts, ends)
+
+    print("Optimized order of %d strokes in %f s. " % (n, time.time() - start))
+    print("Pen-up travel distance reduced from %f mm to %f mm (greedy: %f mm). " %
+          (before, after, greedy))
+
+    return addTravelStrokes(draw, travelSpeed)
+
+
+def addTravelStrokes(draw, travelSpeed):
+    """Inserts a pen-up travel stroke with speed travelSpeed in front of every
+    stroke that does not start at the end of its predecessor."""
+    starts, ends = draw.startPoints(), draw.endPoints()
+    prevEnds = np.concatenate(([[0, 0]], ends[:-1]))
+    moves = np.nonzero(np.any(starts != prevEnds, axis=1))[0]
+    travel = Toolpath(starts[moves], np.arange(moves.shape[0] + 1),
+                      np.zeros(moves.shape, dtype=bool),
+                      np.full(moves.shape, travelSpeed, dtype=np.float64),
+                      dtype=draw.coords.dtype)
+
+    # Interleave travel and drawing strokes
+    key = np.concatenate((moves - 0.5, np.arange(len(draw))))
+    return Toolpath.concatenate([travel, draw]).select(np.argsort(key, kind='stable'))
+
+
+def findEndpointPairs(endpoints, tolerance):
+    """Finds all pairs of endpoints which are at most tolerance apart.
+    Endpoints are hashed into a grid with cell size tolerance, so only the
+    3x3 neighboring cells of every endpoint have to be searched.
+    Returns the indices (i, j) with i < j and the distances of all pairs."""
+    cells = np.floor(endpoints/tolerance).astype(np.int64)
+    cells -= cells.min(axis=0)
+    width = cells[:, 0].max() + 3
+    keys = cells[:, 0] + 1 + (cells[:, 1] + 1)*width
+    sortIdx = np.argsort(keys, kind='stable')
+    sortedKeys = keys[sortIdx]
+
+    pairs = []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            # All endpoints in the neighbor cell (dx, dy) of every endpoint
+            neighbor = keys + dx + dy*width
+            lo = np.searchsorted(sortedKeys, neighbor, side='left')
+            hi = np.searchsorted(sortedKeys, neighbor, side='right')
+            counts = hi - lo
+            i = np.repeat(np.arange(keys.shape[0]), counts)
+            j = sortIdx[np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                        + np.repeat(lo, counts)]
+            pairs.append(np.stack((i, j)))
+
+    i, j = np.concatenate(pairs, axis=1)
+    i, j = i[i < j], j[i < j]
+    dist = np.linalg.norm(endpoints[i] - endpoints[j], axis=1)
+    close = dist <= tolerance
+    return i[close], j[close], dist[close]
+
+
+def joinStrokes(toolpath, tolerance, travelSpeed, penLiftTime=0.6):
+    """Joins drawing strokes whose endpoints are at most tolerance apart into
+    continuous pen-down paths. Strokes are reversed where needed, only strokes with
+    the same speed are joined. Closest endpoints are joined first.
+    Pen-up strokes are replaced by direct travel moves with speed travelSpeed.
+    penLiftTime is the time (seconds) the servo requires to lift and lower the pen
+    (servo_settle_up + servo_settle_down), used to estimate the saved time."""
+    draw = toolpath.select(np.nonzero(toolpath.penDown)[0])
+    n = len(draw)
+    if n < 2:
+        print("Joined no strokes. ")
+        return toolpath
+
+    # Endpoint 2*i is the start of stroke i, endpoint 2*i+1 its end
+    endpoints = np.empty((2*n, 2))
+    endpoints[0::2] = draw.startPoints()
+    endpoints[1::2] = draw.endPoints()
+
+    i, j, dist = findEndpointPairs(endpoints, tolerance)
+    sameSpeed = (draw.speed[i >> 1] == draw.speed[j >> 1]) | \
+        (np.isnan(draw.speed[i >> 1]) & np.isnan(draw.speed[j >> 1]))
+    valid = ((i >> 1) != (j >> 1)) & sameSpeed
+    i, j, dist = i[valid], j[valid], dist[valid]
+    pairOrder = np.argsort(dist, kind='stable')
+
+    # Link endpoints, while keeping every chain of strokes free of cycles
+    link = [-1]*(2*n)
+    root = list(range(n))
+
+    def find(s):
+        while root[s] != s:
+            root[s] = root[root[s]]
+            s = root[s]
+        return s
+
+    joins = 0
+    for a, b in zip(i[pairOrder].tolist(), j[pairOrder].tolist()):
+        if link[a] >= 0 or link[b] >= 0:
+            continue
+        ra, rb = find(a >> 1), find(b >> 1)
+        if ra == rb:
+            continue
+        root[ra] = rb
+        link[a], link[b] = b, a
+        joins += 1
+
+    if joins == 0:
+        print("Joined no strokes. ")
+        return toolpath
+
+    # Walk every chain from one of its free ends
+    order = []
+    reverse = []
+    visited = [False]*n
+    for s in range(n):
+        if visited[s]:
+            continue
+        # Find a free end of the chain, starting at the start of s
+        e = 2*s
+        while link[e] >= 0:
+            e = link[e] ^ 1
+        # Walk the chain, e is the endpoint where the next stroke is entered
+        while True:
+            t = e >> 1
+            visited[t] = True
+            order.append(t)
+            reverse.append(e & 1 == 1)
+            if link[e ^ 1] < 0:
+                break
+            e = link[e ^ 1]
+
+    draw = draw.select(order, reverse)
+
+    # Merge all strokes of a chain, dropping duplicate points at the joints
+    starts = np.zeros((n,), dtype=bool)
+    starts[0] = True
+    endsLinked = np.array([link[2*t + (not r)] >= 0 for t, r in zip(order, reverse)])
+    starts[1:] = ~endsLinked[:-1]
+    first = draw.offsets[:-1]
+    prevEnds = draw.coords[np.maximum(first - 1, 0)]
+    duplicate = ~starts & np.all(draw.coords[first] == prevEnds, axis=1)
+
+    keep = np.ones((draw.numPoints(),), dtype=bool)
+    keep[first[duplicate]] = False
+    chain = np.cumsum(starts) - 1
+    counts = np.bincount(chain[draw.strokeIndex()[keep]], minlength=chain[-1] + 1)
+    joined = Toolpath(draw.coords[keep], np.concatenate(([0], np.cumsum(counts))),
+                      np.ones(counts.shape, dtype=bool), draw.speed[starts],
+                      dtype=draw.coords.dtype)
+
+    print("Joined %d strokes into %d paths, removed %d pen lifts. " %
+          (n, len(joined), joins))
+    print("Estimated time saved by pen lifts: %f s. " % (joins*penLiftTime))
+    return addTravelStrokes(joined, travelSpeed)
@@ -0,0 +1,186 @@
+import numpy as np
+
+
+class MotionPlanner:
+    """Look-ahead planner for stepper moves with trapezoidal velocity profiles.
+
+    A move consists of the signed steps of both steppers and its nominal step delay. All speeds
+    are measured in steps per second of the stepper with the most steps of a move (dominant
+    stepper), the other stepper moves proportionally slower. The acceleration of every move is
+    limited such that no stepper exceeds its max. acceleration.
+
+    The speed at the junction of two moves is limited by the max. speed jump of each stepper,
+    which depends on the angle between both moves. Moves start and end at the max. speed
+    which can be reached or left without acceleration.
+
+    Up to lookahead moves are buffered. When the buffer is full, all buffered moves are planned
+    such that the steppers are able to stop at the end of the buffer and the first half of the
+    buffer is released. The remaining moves are planned again with the following moves.
+    Each released move is split into pieces of constant speed, which are not longer than
+    rampSteps steps during acceleration and deceleration. At low speeds the pieces are shorter,
+    such that the speed doesn't change more than the max. speed jump between two pieces.
+    """
+
+    def __init__(self, config, stepsPerMM):
+        # Limits in steps
+        self.maxAcceleration = np.asarray(
+            config["max_acceleration"], dtype=np.float64)*stepsPerMM
+        self.maxSpeedJump = np.asarray(
+            config["max_speed_jump"], dtype=np.float64)*stepsPerMM
+        self.lookahead = max(config["planner_lookahead"], 2)
+        self.rampSteps = config["planner_ramp_steps"]
+
+        self.moves = []
+        # Fixed entry speed of the first buffered move, None if the steppers are at rest
+        self.entrySpeed = None
+
+        self.naiveTime = 0.0
+        self.plannedTime = 0.0
+
+    def add(self, steps, stepDelay):
+        """Adds the moves steps (N,2) with the nominal step delay stepDelay.
+        Returns the steps (M,2) and step delays (M,) of all released pieces."""
+        for s in steps:
+            self.moves.append((s, stepDelay))
+
+        released = []
+        while len(self.moves) >= self.lookahead:
+            released.append(self.plan(self.lookahead//2))
+        return self.concatenate(released)
+
+    def flush(self):
+        """Releases all buffered moves, the steppers stop at the end.
+        Returns the steps (M,2) and step delays (M,) of all released pieces."""
+        released = self.plan(len(self.moves))
+        self.entrySpeed = None
+        return released
+
+    def hasMoves(self):
+        return len(self.moves) > 0
+
+    def plan(self, count):
+        """Plans all buffered moves and releases the first count moves."""
+        if count == 0:
+            return self.concatenate([])
+
+        steps = np.array([m[0] for m in self.moves], dtype=np.int64)
+        stepDelay = np.array([m[1] for m in self.moves], dtype=np.float64)
+
+        length, acceleration, stopSpeed, junctionSpeed = self.limits(steps)
+        nominalSpeed = 1/stepDelay
+
+        # Max. entry speed of every move
+        maxEntry = np.empty_like(nominalSpeed)
+        maxEntry[0] = min(nominalSpeed[0], stopSpeed[0]) \
+            if self.entrySpeed is None else self.entrySpeed
+        maxEntry[1:] = np.minimum(junctionSpeed, np.minimum(
+            nominalSpeed[1:], nominalSpeed[:-1]))
+
+        # Backward pass: Every move has to be able to decelerate to the entry of the next move
+        n = steps.shape[0]
+        entry = np.empty((n,))
+        exit = np.empty((n,))
+        nextEntry = min(nominalSpeed[-1], stopSpeed[-1])
+        for k in range(n - 1, -1, -1):
+            exit[k] = nextEntry
+            nextEntry = entry[k] = min(maxEntry[k], np.sqrt(
+                nextEntry**2 + 2*acceleration[k]*length[k]))
+
+        # Forward pass: Every move has to be able to accelerate to the entry of the next move
+        for k in range(n):
+            if k > 0:
+                entry[k] = exit[k - 1]
+            exit[k] = min(exit[k], np.sqrt(
+                entry[k]**2 + 2*acceleration[k]*length[k]))
+
+        self.entrySpeed = exit[count - 1]
+        del self.moves[:count]
+
+        steps, stepDelay = self.profile(steps[:count], length[:count], acceleration[:count],
+                                        entry[:count], exit[:count], nominalSpeed[:count],
+                                        stopSpeed[:count])
+        self.naiveTime += np.sum(length[:count]/nominalSpeed[:count])
+        self.plannedTime += np.sum(np.max(np.abs(steps), axis=1)*stepDelay)
+        return steps, stepDelay
+
+    def limits(self, steps):
+        """Returns the length (steps of the dominant stepper), the max. acceleration, the max. speed
+        when starting or stopping of the moves steps (N,2) and the max. speed at the N-1 junctions
+        between consecutive moves."""
+        length = np.max(np.abs(steps), axis=1).astype(np.float64)
+        direction = steps/length[:, None]
+        with np.errstate(divide='ignore'):
+            acceleration = np.min(
+                self.maxAcceleration/np.abs(direction), axis=1)
+            stopSpeed = np.min(self.maxSpeedJump/np.abs(direction), axis=1)
+            junctionSpeed = np.min(
+                self.maxSpeedJump/np.abs(np.diff(direction, axis=0)), axis=1)
+        return length, acceleration, stopSpeed, junctionSpeed
+
+    @staticmethod
+    def trapezoid(length, acceleration, entry, exit, nominalSpeed):
+        """Returns the cruise speed and the lengths of the acceleration, cruise and deceleration
+        phases of moves with the given entry and exit speeds."""
+        cruise = np.minimum(nominalSpeed, np.sqrt(
+            (2*acceleration*length + entry**2 + exit**2)/2))
+        cruise = np.maximum(cruise, np.maximum(entry, exit))
+        accelLength = np.clip((cruise**2 - entry**2) /
+                              (2*acceleration), 0, length)
+        decelLength = np.clip((cruise**2 - exit**2) /
+                              (2*acceleration), 0, length - accelLength)
+        cruiseLength = length - accelLength - decelLength
+        return cruise, accelLength, cruiseLength, decelLength
+
+    def profile(self, steps, length, acceleration, entry, exit, nominalSpeed, speedJump):
+        """Splits the moves into pieces of constant speed along their trapezoidal profiles.
+        The speed changes at most by speedJump (max. speed jump of the dominant stepper, see
+        limits) from one piece to the next. Returns the steps (M,2) and step delays (M,) of all pieces."""
+        cruise, accelLength, cruiseLength, decelLength = self.trapezoid(
+            length, acceleration, entry, exit, nominalSpeed)
+
+        # Boundaries of all pieces of a move: start, acceleration pieces,
+        # end of cruise, deceleration pieces.
+        # The ramps are split into pieces of equal length. The speed changes most in the
+        # slowest piece, which limits the piece length at low speeds.
+        def numPieces(rampLength, rampStart):
+            maxLength = np.minimum(self.rampSteps, ((rampStart + speedJump)**2 - rampStart**2) /
+                                   (2*acceleration))
+            return np.ceil(rampLength/maxLength).astype(np.int64)
+        numAccel = numPieces(accelLength, entry)
+        numDecel = numPieces(decelLength, exit)
+        counts = numAccel + numDecel + 2
+        move = np.repeat(np.arange(steps.shape[0]), counts)
+        j = np.arange(move.shape[0]) - np.repeat(np.cumsum(counts) - counts, counts)
+
+        inAccel = j <= numAccel[move]
+        pos = np.where(inAccel,
+                       accelLength[move]*j/np.maximum(numAccel[move], 1),
+                       accelLength[move] + cruiseLength[move] + decelLength[move] *
+                       (j - numAccel[move] - 1)/np.maximum(numDecel[move], 1))
+        pos = np.rint(pos)
+
+        # Time of every boundary
+        a, v0, v1, vc = acceleration[move], entry[move], exit[move], cruise[move]
+        accelEnd, decelStart = accelLength[move], (accelLength + cruiseLength)[move]
+        x = np.minimum(pos, accelEnd)
+        time = (np.sqrt(v0**2 + 2*a*x) - v0)/a
+        x = np.clip(pos, accelEnd, decelStart)
+        time += (x - accelEnd)/vc
+        x = np.maximum(pos - decelStart, 0)
+        time += (vc - np.sqrt(np.maximum(vc**2 - 2*a*x, v1**2)))/a
+
+        # Steps of all pieces with cumulative rounding
+        stepPos = np.rint(steps[move]*(pos/length[move])[:, None]).astype(np.int64)
+        pieceSteps = np.diff(stepPos, axis=0)
+        pieceDominant = np.diff(pos)
+        pieceTime = np.diff(time)
+
+        # Drop the differences between two moves and empty pieces
+        keep = (move[1:] == move[:-1]) & (pieceDominant > 0)
+        return pieceSteps[keep], pieceTime[keep]/pieceDominant[keep]
+
+    @staticmethod
+    def concatenate(released):
+        if len(released) == 0:
+            return np.zeros((0, 2), dtype=np.int64), np.zeros((0,))
+        return np.concatenate([r[0] for r in released]), np.concatenate([r[1] for r in released])
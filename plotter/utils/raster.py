@@ -0,0 +1,76 @@
+import numpy as np
+
+
+def rasterizeSegments(canvas, segments, pxPerMM, antialias=False, maxSamples=1 << 22):
+    """Draws the line segments (N,2,2) (coordinates in mm) into canvas (H,W) with pxPerMM pixels
+    per mm. Every segment is sampled with at least two samples per pixel, all samples are drawn
+    at once. Without antialiasing, the pixels of all samples are set to 1. With antialiasing,
+    every sample adds its length (px) to the 4 closest pixels with bilinear weights, so the
+    canvas holds the line coverage of each pixel (values > 1 where lines overlap).
+    Samples outside of the canvas are dropped. Segments are drawn in chunks of about
+    maxSamples samples to limit the memory."""
+    segments = np.asarray(segments, dtype=np.float64)*pxPerMM
+    delta = segments[:, 1] - segments[:, 0]
+    samples = np.maximum(
+        np.ceil(2*np.max(np.abs(delta), axis=1)), 1).astype(np.int64)
+    if not antialias:
+        samples += 1
+
+    ends = np.cumsum(samples)
+    start = 0
+    while start < segments.shape[0]:
+        stop = max(np.searchsorted(ends, ends[start] - samples[start] + maxSamples), start + 1)
+        drawSamples(canvas, segments[start:stop], delta[start:stop],
+                    samples[start:stop], antialias)
+        start = stop
+
+
+def drawSamples(canvas, segments, delta, samples, antialias):
+    h, w = canvas.shape
+    segment = np.repeat(np.arange(segments.shape[0]), samples)
+    j = np.arange(segment.shape[0]) - \
+        np.repeat(np.cumsum(samples) - samples, samples)
+
+    if not antialias:
+        # Samples include both end points, pixel i covers [i, i+1)
+        t = j/np.maximum(samples[segment] - 1, 1)
+        x = np.floor(segments[segment, 0, 0] + delta[segment, 0]*t).astype(np.int64)
+        y = np.floor(segments[segment, 0, 1] + delta[segment, 1]*t).astype(np.int64)
+        inside = (x >= 0) & (x < w) & (y >= 0) & (y < h)
+        canvas.flat[y[inside]*w + x[inside]] = 1
+        return
+
+    # Samples in the middle of equally long pieces, pixel centers are at i+0.5
+    t = (j + 0.5)/samples[segment]
+    weight = np.hypot(delta[:, 0], delta[:, 1])[segment]/samples[segment]
+    x = segments[segment, 0, 0] + delta[segment, 0]*t - 0.5
+    y = segments[segment, 0, 1] + delta[segment, 1]*t - 0.5
+    x0, y0 = np.floor(x), np.floor(y)
+    fx, fy = x - x0, y - y0
+    x0, y0 = x0.astype(np.int64), y0.astype(np.int64)
+
+    coverage = np.zeros((h*w,))
+    for dx, dy, wgt in ((0, 0, (1 - fx)*(1 - fy)), (1, 0, fx*(1 - fy)),
+                        (0, 1, (1 - fx)*fy), (1, 1, fx*fy)):
+        xi, yi = x0 + dx, y0 + dy
+        inside = (xi >= 0) & (xi < w) & (yi >= 0) & (yi < h)
+        coverage += np.bincount(yi[inside]*w + xi[inside],
+                                weight[inside]*wgt[inside], h*w)
+    canvas += coverage.reshape(h, w).astype(canvas.dtype)
+
+
+def composeImage(ink, travel=None):
+    """Returns an RGB image (H,W,3) (uint8) of the ink coverage (H,W) on white paper
+    with an optional overlay of the travel coverage (H,W) in red."""
+    paper = 1 - np.clip(ink, 0, 1, dtype=np.float32)
+    image = np.empty(ink.shape + (3,), dtype=np.uint8)
+    if travel is None:
+        image[:] = np.rint(paper*255).astype(np.uint8)[:, :, None]
+        return image
+
+    # Travel moves are drawn with half opacity on top of the ink
+    alpha = 0.5*np.clip(travel, 0, 1, dtype=np.float32)
+    paper *= 1 - alpha
+    image[:, :, 1] = image[:, :, 2] = np.rint(paper*255)
+    image[:, :, 0] = np.rint((paper + alpha)*255)
+    return image
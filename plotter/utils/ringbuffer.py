@@ -0,0 +1,151 @@
+import time
+import numpy as np
+
+from multiprocessing import shared_memory
+
+
+# Record of a single motor command.
+# kind: Stepper move (RingBuffer.STEPS) or pen move (RingBuffer.PEN)
+# steps: Signed steps of both steppers
+# value: Delay between two steps (seconds) of a stepper move or servo position of a pen move
+RINGBUFFER_DTYPE = np.dtype([("value", np.float64),
+                             ("steps", np.int32, (2,)),
+                             ("kind", np.int32)], align=True)
+
+
+def stepRecords(steps, stepDelay):
+    """Returns the records of the stepper moves steps (N,2), all with the same step delay."""
+    records = np.empty((len(steps),), dtype=RINGBUFFER_DTYPE)
+    records["value"] = stepDelay
+    records["steps"] = steps
+    records["kind"] = RingBuffer.STEPS
+    return records
+
+
+class RingBuffer:
+    """Lock-free single producer / single consumer ring buffer of motor commands
+    (see RINGBUFFER_DTYPE) in shared memory.
+
+    The header holds the number of written and read records, the underrun counter and
+    the closed flag. Each counter is only written by one side: The producer writes
+    records and then advances the write counter, the consumer reads records and then
+    advances the read counter. Both sides poll if the buffer is full or empty.
+    The buffer has to be created before the consumer process is started.
+    """
+    STEPS = 0
+    PEN = 1
+
+    # Indices of the header counters
+    WRITTEN = 0
+    READ = 1
+    UNDERRUNS = 2
+    CLOSED = 3
+
+    def __init__(self, capacity, pollInterval=0.0002):
+        self.capacity = capacity
+        self.pollInterval = pollInterval
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=4*8 + capacity*RINGBUFFER_DTYPE.itemsize)
+        self.setupViews()
+        self.header[:] = 0
+
+    def setupViews(self):
+        self.header = np.ndarray((4,), dtype=np.int64, buffer=self.shm.buf)
+        self.records = np.ndarray((self.capacity,), dtype=RINGBUFFER_DTYPE,
+                                  buffer=self.shm.buf, offset=self.header.nbytes)
+        self.kind = self.records["kind"]
+        self.steps = self.records["steps"]
+        self.value = self.records["value"]
+
+        # Local copies of the own counter
+        self.written = int(self.header[RingBuffer.WRITTEN])
+        self.read = int(self.header[RingBuffer.READ])
+        self.waiting = False
+
+    def __getstate__(self):
+        # Views can not be pickled, they are recreated from the shared memory
+        return {"capacity": self.capacity, "pollInterval": self.pollInterval, "shm": self.shm}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.setupViews()
+
+    def put(self, kind, steps0, steps1, value):
+        """Appends a record. Blocks while the buffer is full. Producer only."""
+        while self.written - int(self.header[RingBuffer.READ]) >= self.capacity:
+            time.sleep(self.pollInterval)
+
+        i = self.written % self.capacity
+        self.kind[i] = kind
+        self.steps[i, 0] = steps0
+        self.steps[i, 1] = steps1
+        self.value[i] = value
+
+        # Publish the record
+        self.written += 1
+        self.header[RingBuffer.WRITTEN] = self.written
+
+    def putRecords(self, records):
+        """Appends an array of records (see RINGBUFFER_DTYPE) with vectorized copies.
+        Blocks while the buffer is full. Producer only."""
+        i = 0
+        while i < records.shape[0]:
+            free = self.capacity - (self.written - int(self.header[RingBuffer.READ]))
+            if free == 0:
+                time.sleep(self.pollInterval)
+                continue
+
+            # Copy up to the end of the buffer or the end of the free space
+            start = self.written % self.capacity
+            n = min(free, self.capacity - start, records.shape[0] - i)
+            self.records[start:start + n] = records[i:i + n]
+            i += n
+
+            # Publish the records
+            self.written += n
+            self.header[RingBuffer.WRITTEN] = self.written
+
+    def close(self):
+        """Signals the consumer that no more records will be written. Producer only."""
+        self.header[RingBuffer.CLOSED] = 1
+
+    def get(self):
+        """Removes the oldest record and returns it as (kind, steps0, steps1, value).
+        Blocks while the buffer is empty, returns None if the buffer is empty and closed.
+        Running empty after the first record counts as underrun. Consumer only."""
+        while self.read >= int(self.header[RingBuffer.WRITTEN]):
+            if self.header[RingBuffer.CLOSED]:
+                # All records might have been written just before closing
+                if self.read >= int(self.header[RingBuffer.WRITTEN]):
+                    return None
+                continue
+
+            if not self.waiting and self.read > 0:
+                self.header[RingBuffer.UNDERRUNS] += 1
+            self.waiting = True
+            time.sleep(self.pollInterval)
+
+        self.waiting = False
+        i = self.read % self.capacity
+        record = (int(self.kind[i]), int(self.steps[i, 0]),
+                  int(self.steps[i, 1]), float(self.value[i]))
+
+        # Release the slot
+        self.read += 1
+        self.header[RingBuffer.READ] = self.read
+        return record
+
+    def occupancy(self):
+        """Returns the number of records that are currently buffered."""
+        return int(self.header[RingBuffer.WRITTEN] - self.header[RingBuffer.READ])
+
+    def underruns(self):
+        """Returns how often the consumer ran out of records after the first one."""
+        return int(self.header[RingBuffer.UNDERRUNS])
+
+    def release(self):
+        """Releases the shared memory. Must be called by the creating process
+        after the consumer has finished."""
+        del self.header, self.records, self.kind, self.steps, self.value
+        self.shm.close()
+        self.shm.unlink()
@@ -0,0 +1,43 @@
+import numpy as np
+
+
+class SegmentBuffer:
+    """Growable buffer of line segments (N,2,2)."""
+
+    def __init__(self, capacity=4096):
+        self.segments = np.empty((capacity, 2, 2))
+        self.size = 0
+
+    def reserve(self, n):
+        if self.size + n > self.segments.shape[0]:
+            grown = np.empty(
+                (max(2*self.segments.shape[0], self.size + n), 2, 2))
+            grown[:self.size] = self.segments[:self.size]
+            self.segments = grown
+
+    def add(self, start, end):
+        """Appends the segment from start to end."""
+        self.reserve(1)
+        self.segments[self.size, 0] = start
+        self.segments[self.size, 1] = end
+        self.size += 1
+
+    def addPolyline(self, points):
+        """Appends the segments between the consecutive points (N,2)."""
+        n = points.shape[0] - 1
+        if n < 1:
+            return
+        self.reserve(n)
+        self.segments[self.size:self.size + n, 0] = points[:-1]
+        self.segments[self.size:self.size + n, 1] = points[1:]
+        self.size += n
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        return self.segments[:self.size][index]
+
+    def clear(self):
+        """Removes all segments, the capacity is kept."""
+        self.size = 0
@@ -0,0 +1,103 @@
+import numpy as np
+
+from plotter.utils.ringbuffer import RINGBUFFER_DTYPE
+
+
+# Header of step plan files: Magic, version, size of a single record, the calibration
+# the plan was compiled for and the state of the plotter at the end of the plan
+STEPPLAN_HEADER = np.dtype([("magic", "S3"), ("version", np.uint8), ("recordSize", np.uint32),
+                            ("base", np.float64), ("origin", np.float64, (2,)),
+                            ("stepsPerMM", np.float64), ("microStepping", np.int64),
+                            ("endPos", np.float64, (2,)), ("endCordLength", np.float64, (2,)),
+                            ("penDown", np.int64)])
+STEPPLAN_MAGIC = b"VPS"
+STEPPLAN_VERSION = 1
+
+
+class StepPlanWriter:
+    """Writes motor commands (see RINGBUFFER_DTYPE) to a step plan file, chunkSize records
+    at a time. The header is written again with the final plotter state when closing."""
+
+    def __init__(self, file_name, calib, microStepping, chunkSize=65536):
+        self.file = open(file_name, 'wb')
+        self.header = np.zeros((1,), dtype=STEPPLAN_HEADER)
+        self.header["magic"] = STEPPLAN_MAGIC
+        self.header["version"] = STEPPLAN_VERSION
+        self.header["recordSize"] = RINGBUFFER_DTYPE.itemsize
+        self.header["base"] = calib.base
+        self.header["origin"] = calib.origin
+        self.header["stepsPerMM"] = calib.stepsPerMM
+        self.header["microStepping"] = microStepping
+        self.header.tofile(self.file)
+
+        self.chunk = np.zeros((chunkSize,), dtype=RINGBUFFER_DTYPE)
+        self.size = 0
+        self.numRecords = 0
+
+    def put(self, kind, steps0, steps1, value):
+        """Appends a record (see RingBuffer.put)."""
+        self.chunk[self.size] = (value, (steps0, steps1), kind)
+        self.size += 1
+        if self.size == self.chunk.shape[0]:
+            self.flush()
+
+    def putRecords(self, records):
+        """Appends an array of records (see RINGBUFFER_DTYPE)."""
+        if self.size + records.shape[0] > self.chunk.shape[0]:
+            self.flush()
+        if records.shape[0] >= self.chunk.shape[0]:
+            records.tofile(self.file)
+            self.numRecords += records.shape[0]
+            return
+
+        self.chunk[self.size:self.size + records.shape[0]] = records
+        self.size += records.shape[0]
+
+    def flush(self):
+        self.chunk[:self.size].tofile(self.file)
+        self.numRecords += self.size
+        self.size = 0
+
+    def close(self, endPos, endCordLength, penDown):
+        """Writes all remaining records and the final plotter state."""
+        self.flush()
+        self.header["endPos"] = endPos
+        self.header["endCordLength"] = endCordLength
+        self.header["penDown"] = penDown
+        self.file.seek(0)
+        self.header.tofile(self.file)
+        self.file.close()
+
+
+def readStepPlanHeader(file_name):
+    """Reads and validates the header of a step plan file."""
+    header = np.fromfile(file_name, dtype=STEPPLAN_HEADER, count=1)
+    if header.shape[0] != 1 or header["magic"][0] != STEPPLAN_MAGIC or \
+            header["version"][0] != STEPPLAN_VERSION or \
+            header["recordSize"][0] != RINGBUFFER_DTYPE.itemsize:
+        raise ValueError("Invalid step plan file: " + file_name)
+    return header[0]
+
+
+def checkStepPlanCalibration(header, calib, microStepping):
+    """Returns True if a step plan was compiled for the given calibration."""
+    return np.isclose(header["base"], calib.base) and \
+        np.allclose(header["origin"], calib.origin) and \
+        np.isclose(header["stepsPerMM"], calib.stepsPerMM) and \
+        header["microStepping"] == microStepping
+
+
+def iterStepPlan(file_name, chunkSize=65536):
+    """Iterates over the records of a step plan file in memory mapped chunks of
+    chunkSize records. Each chunk is unmapped when the next one is requested."""
+    readStepPlanHeader(file_name)
+    with open(file_name, 'rb') as f:
+        f.seek(0, 2)
+        numRecords = (f.tell() - STEPPLAN_HEADER.itemsize) // RINGBUFFER_DTYPE.itemsize
+
+    for start in range(0, numRecords, chunkSize):
+        chunk = np.memmap(file_name, dtype=RINGBUFFER_DTYPE, mode='r',
+                          shape=(min(chunkSize, numRecords - start),),
+                          offset=STEPPLAN_HEADER.itemsize + start*RINGBUFFER_DTYPE.itemsize)
+        yield chunk
+        del chunk
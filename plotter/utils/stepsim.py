@@ -0,0 +1,84 @@
+import numpy as np
+
+
+# Ideal path of a stepper move: The straight line start-end or the arc around center with radius
+# (nan for straight lines). stepCount is the number of steps of both steppers at the end of the move.
+IDEAL_MOVE_DTYPE = np.dtype([("start", np.float64, (2,)),
+                             ("end", np.float64, (2,)),
+                             ("center", np.float64, (2,)),
+                             ("radius", np.float64),
+                             ("stepCount", np.int64)])
+
+
+def tickPositions(steps):
+    """Returns the step positions (T,2) of both steppers after every tick of the moves steps (N,2),
+    relative to the start of the first move, and the index (T,) of the move of every tick.
+    The steps of a move are merged with the same integer DDA as StepperCtrl.doSteps, which has a
+    tick for every step of the stepper with the most steps."""
+    absSteps = np.abs(steps)
+    maxSteps = np.max(absSteps, axis=1)
+    move = np.repeat(np.arange(steps.shape[0]), maxSteps)
+    tick = np.arange(1, move.shape[0] + 1, dtype=np.float64) - \
+        np.repeat((np.cumsum(maxSteps) - maxSteps).astype(np.float64), maxSteps)
+
+    # The integer division of the DDA in floating point. It is exact, because the
+    # quotients of these small integers can't be rounded up to the next integer.
+    partial = tick[:, None]*absSteps[move]
+    partial += (maxSteps//2)[move, None]
+    partial /= maxSteps[move, None]
+    np.floor(partial, out=partial)
+    partial *= np.sign(steps)[move]
+    partial += (np.cumsum(steps, axis=0) - steps)[move]
+    return partial, move
+
+
+def idealDeviation(points, moves, index):
+    """Returns the distance of the points (N,2) to the ideal paths of the moves (M,)
+    (see IDEAL_MOVE_DTYPE), index (N,) is the move of every point."""
+    delta = moves["end"] - moves["start"]
+    lenSq = np.sum(delta**2, axis=1)
+    scale = 1/np.where(lenSq > 0, lenSq, 1)
+
+    # Distance to the straight lines
+    p = points - moves["start"][index]
+    d = delta[index]
+    t = np.clip((p[:, 0]*d[:, 0] + p[:, 1]*d[:, 1])*scale[index], 0, 1)
+    p -= t[:, None]*d
+    dist = np.hypot(p[:, 0], p[:, 1])
+
+    # Distance to the arcs
+    isArc = ~np.isnan(moves["radius"])
+    if np.any(isArc):
+        arc = isArc[index]
+        dist[arc] = np.abs(np.linalg.norm(points[arc] - moves["center"][index[arc]], axis=1) -
+                           moves["radius"][index[arc]])
+    return dist
+
+
+class DeviationStats:
+    """Accumulates the max. and RMS deviation of simulated pen positions."""
+
+    def __init__(self):
+        self.count = 0
+        self.sumSq = 0.0
+        self.max = 0.0
+        self.maxPos = np.full((2,), np.nan)
+
+    def add(self, points, deviation):
+        if deviation.shape[0] == 0:
+            return
+        i = np.argmax(deviation)
+        if deviation[i] > self.max:
+            self.max = deviation[i]
+            self.maxPos = points[i]
+        self.count += deviation.shape[0]
+        self.sumSq += np.sum(deviation**2)
+
+    def rms(self):
+        return np.sqrt(self.sumSq/self.count) if self.count > 0 else 0.0
+
+    def __str__(self):
+        if self.count == 0:
+            return "no steps"
+        return "max. %.3f mm at (%.1f, %.1f), RMS %.3f mm over %d ticks" % (
+            self.max, self.maxPos[0], self.maxPos[1], self.rms(), self.count)
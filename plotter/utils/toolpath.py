@@ -0,0 +1,280 @@
+import numpy as np
+
+from plotter.utils.gcode import *
+from plotter.utils.math import simplifyPolylines
+
+
+class Toolpath:
+    """Compact array based representation of a plotter job.
+
+    A toolpath is a sequence of strokes. A stroke is a polyline that is executed
+    with a single pen state and speed: The pen is lifted or lowered and the
+    plotter moves through all points of the stroke in order.
+    The points of all strokes are stored in one contiguous (N,2) array,
+    stroke i consists of the points coords[offsets[i]:offsets[i+1]].
+    A speed of NaN keeps the current speed of the plotter.
+    """
+
+    def __init__(self, coords, offsets, penDown, speed, dtype=np.float64):
+        self.coords = np.ascontiguousarray(coords, dtype=dtype).reshape(-1, 2)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.penDown = np.asarray(penDown, dtype=bool)
+        self.speed = np.asarray(speed, dtype=np.float64)
+
+        assert(self.offsets.shape[0] == self.penDown.shape[0] + 1)
+        assert(self.penDown.shape == self.speed.shape)
+        assert(self.offsets[0] == 0 and self.offsets[-1] == self.coords.shape[0])
+
+    @classmethod
+    def empty(cls, dtype=np.float64):
+        """Creates a toolpath without any strokes."""
+        return cls(np.zeros((0, 2)), [0], [], [], dtype=dtype)
+
+    @classmethod
+    def fromStrokes(cls, strokes, dtype=np.float64):
+        """Creates a toolpath from a list of (points, penDown, speed) tuples."""
+        if len(strokes) == 0:
+            return cls.empty(dtype)
+
+        points = [np.reshape(s[0], (-1, 2)) for s in strokes]
+        offsets = np.concatenate(
+            ([0], np.cumsum([p.shape[0] for p in points])))
+        return cls(np.concatenate(points), offsets,
+                   [s[1] for s in strokes],
+                   [np.nan if s[2] is None else s[2] for s in strokes], dtype=dtype)
+
+    @classmethod
+    def concatenate(cls, toolpaths):
+        """Concatenates the strokes of multiple toolpaths."""
+        if len(toolpaths) == 0:
+            return cls.empty()
+
+        offsets = [[0]]
+        numPoints = 0
+        for t in toolpaths:
+            offsets.append(t.offsets[1:] + numPoints)
+            numPoints += t.numPoints()
+
+        return cls(np.concatenate([t.coords for t in toolpaths]),
+                   np.concatenate(offsets),
+                   np.concatenate([t.penDown for t in toolpaths]),
+                   np.concatenate([t.speed for t in toolpaths]),
+                   dtype=toolpaths[0].coords.dtype)
+
+    @classmethod
+    def fromCommands(cls, cmds, arcResolution=1.0, dtype=np.float64):
+        """Converts parsed gcode commands (see parseGCode) into a toolpath.
+        A new stroke starts whenever the pen state or the speed changes, it begins
+        at the current position. Arcs are sampled with segments of at most arcResolution mm."""
+        code = cmds["code"]
+        isArc = code == b"G2"
+        isMove = (code == b"G0") | isArc | (code == b"G28")
+        isPen = (code == b"M3") | (code == b"M4")
+        hasSpeed = (isMove & cmds["hasS"])
+
+        def forwardFill(values, defined, initial):
+            # Value of the last row (inclusive) where defined is set
+            idx = np.where(defined, np.arange(values.shape[0]), -1)
+            np.maximum.accumulate(idx, out=idx)
+            return np.where(idx >= 0, values[np.maximum(idx, 0)], initial)
+
+        # State of the plotter after every command
+        penDown = forwardFill(code == b"M3", isPen, False)
+        speed = forwardFill(cmds["S"], hasSpeed, np.nan)
+
+        # Every change of pen state or speed starts a new stroke
+        prevPenDown = np.concatenate(([False], penDown[:-1]))
+        prevSpeed = np.concatenate(([np.nan], speed[:-1]))
+        changes = (isPen & (penDown != prevPenDown)) | \
+            (hasSpeed & ~((speed == prevSpeed) | np.isnan(prevSpeed) & np.isnan(speed)))
+        strokeId = np.cumsum(changes)
+
+        moves = np.nonzero(isMove)[0]
+        cmds, isArc, strokeId = cmds[moves], isArc[moves], strokeId[moves]
+        penDown, speed = penDown[moves], speed[moves]
+
+        # End position of every move, missing coordinates of G0 keep their value
+        a = np.where(cmds["hasA"], cmds["A"], 0)
+        b = np.where(cmds["hasB"], cmds["B"], 360)
+        sweep = np.radians(b - a)
+        ends = np.zeros((moves.shape[0], 2))
+        for i, k in enumerate("XY"):
+            arcEnd = cmds[k] + cmds["R"]*(np.cos, np.sin)[i](np.radians(a) + sweep)
+            end = np.where(isArc, arcEnd, np.where(cmds["code"] == b"G28", 0, cmds[k]))
+            ends[:, i] = forwardFill(end, cmds["has" + k] | (cmds["code"] != b"G0"), 0)
+
+        # Every move adds its end point (arcs: all samples including the start),
+        # the first move of every stroke additionally adds the current position
+        first = np.ones((moves.shape[0],), dtype=bool)
+        first[1:] = strokeId[1:] != strokeId[:-1]
+        segments = np.maximum(np.ceil(np.abs(sweep)*cmds["R"]/arcResolution), 1)
+        counts = np.where(isArc, segments + 1, 1).astype(np.int64) + first
+
+        row = np.repeat(np.arange(moves.shape[0]), counts)
+        j = np.arange(row.shape[0]) - np.repeat(np.cumsum(counts) - counts, counts) - first[row]
+        coords = ends[row]
+        arcPoints = isArc[row] & (j >= 0)
+        angles = np.radians(a[row][arcPoints]) + \
+            sweep[row][arcPoints]*(j[arcPoints]/segments[row][arcPoints])
+        radii = cmds["R"][row][arcPoints]
+        coords[arcPoints, 0] = cmds["X"][row][arcPoints] + radii*np.cos(angles)
+        coords[arcPoints, 1] = cmds["Y"][row][arcPoints] + radii*np.sin(angles)
+        prevEnds = np.concatenate(([[0, 0]], ends[:-1]))
+        coords[j < 0] = prevEnds[row[j < 0]]
+
+        # Strokes without any movement have no effect
+        starts = np.nonzero(first)[0]
+        offsets = np.concatenate(([0], np.cumsum(np.add.reduceat(counts, starts)
+                                                 if starts.shape[0] > 0 else [])))
+        toolpath = cls(coords, offsets, penDown[starts], speed[starts], dtype=dtype)
+        return toolpath.select(np.nonzero(np.diff(toolpath.offsets) > 1)[0])
+
+    @classmethod
+    def fromGCode(cls, gcode, arcResolution=1.0, dtype=np.float64):
+        """Parses a gcode stream (iterable of string commands) into a toolpath.
+        Arcs are sampled with segments of at most arcResolution mm."""
+        return cls.fromCommands(parseGCode("\n".join(gcode)), arcResolution, dtype)
+
+    @classmethod
+    def fromGCodeFile(cls, file_name, arcResolution=1.0, dtype=np.float64):
+        """Parses a gcode file into a toolpath."""
+        return cls.fromCommands(readGCodeFile(file_name), arcResolution, dtype)
+
+    def __len__(self):
+        """Returns the number of strokes."""
+        return self.penDown.shape[0]
+
+    def numPoints(self):
+        return self.coords.shape[0]
+
+    def stroke(self, i):
+        """Returns the points of stroke i."""
+        return self.coords[self.offsets[i]:self.offsets[i+1]]
+
+    def strokeIndex(self):
+        """Returns the index of the stroke for every point."""
+        return np.repeat(np.arange(len(self)), np.diff(self.offsets))
+
+    def startPoints(self):
+        return self.coords[self.offsets[:-1]]
+
+    def endPoints(self):
+        return self.coords[self.offsets[1:] - 1]
+
+    def segmentLengths(self):
+        """Returns the distance of every point to its predecessor in the same stroke.
+        The first point of each stroke has length 0."""
+        lengths = np.zeros((self.numPoints(),))
+        lengths[1:] = np.hypot(np.diff(self.coords[:, 0]),
+                               np.diff(self.coords[:, 1]))
+        lengths[self.offsets[:-1]] = 0
+        return lengths
+
+    def strokeLengths(self):
+        lengths = np.concatenate(([0], np.cumsum(self.segmentLengths())))
+        return lengths[self.offsets[1:]] - lengths[self.offsets[:-1]]
+
+    def boundingBox(self):
+        """Returns the bounding box ((xmin, ymin), (xmax, ymax)) of all points."""
+        return self.coords.min(axis=0), self.coords.max(axis=0)
+
+    def select(self, indices, reverse=None):
+        """Returns a new toolpath with the strokes at the given indices, in the given order.
+        If specified, reverse is a boolean array which reverses the points of the selected strokes."""
+        indices = np.asarray(indices, dtype=np.int64)
+        counts = np.diff(self.offsets)[indices]
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+
+        # Gather the points of all selected strokes at once
+        src = np.arange(offsets[-1]) - np.repeat(offsets[:-1], counts)
+        if reverse is not None:
+            rev = np.repeat(reverse, counts)
+            src[rev] = np.repeat(counts - 1, counts)[rev] - src[rev]
+        src += np.repeat(self.offsets[indices], counts)
+
+        return Toolpath(self.coords[src], offsets, self.penDown[indices],
+                        self.speed[indices], dtype=self.coords.dtype)
+
+    def iterStrokes(self):
+        """Iterates over all strokes as (points, penDown, speed) tuples."""
+        for i in range(len(self)):
+            yield self.stroke(i), bool(self.penDown[i]), float(self.speed[i])
+
+    def iterGCode(self):
+        """Renders the toolpath as gcode stream."""
+        yield GCode_up()
+        yield GCode_home()
+
+        pos = np.zeros((2,))
+        penDown = False
+        speed = np.nan
+
+        for points, down, s in self.iterStrokes():
+            if down != penDown:
+                yield GCode_down() if down else GCode_up()
+                penDown = down
+
+            for p in points:
+                # Skip moves to the current position
+                if p[0] == pos[0] and p[1] == pos[1]:
+                    continue
+
+                if not np.isnan(s) and s != speed:
+                    yield GCode_goTo(p, s)
+                    speed = s
+                else:
+                    yield GCode_goTo(p)
+                pos = p
+
+
+def simplifyToolpath(toolpath, tolerance):
+    """Simplifies all strokes with the Ramer-Douglas-Peucker algorithm.
+    Removed points are closer than tolerance to the simplified strokes."""
+    keep = simplifyPolylines(toolpath.coords, toolpath.offsets, tolerance)
+    counts = np.bincount(toolpath.strokeIndex()[keep], minlength=len(toolpath))
+    return Toolpath(toolpath.coords[keep], np.concatenate(([0], np.cumsum(counts))),
+                    toolpath.penDown, toolpath.speed, dtype=toolpath.coords.dtype)
+
+
+def postProcessToolpath(toolpath, minSegmentLen=1, simplifyTolerance=0):
+    """Vectorized counterpart of postProcessGCode for toolpaths.
+    Simplifies all strokes if simplifyTolerance is > 0 (see simplifyToolpath).
+    Thins out the points of each stroke, such that consecutive points are at least
+    minSegmentLen apart (measured along the stroke). The first and last point of each
+    stroke are always kept. Drawing strokes shorter than minSegmentLen are removed."""
+    init_size = toolpath.numPoints()
+
+    if simplifyTolerance > 0:
+        toolpath = simplifyToolpath(toolpath, simplifyTolerance)
+
+    if minSegmentLen > 0:
+        cumLen = np.cumsum(toolpath.segmentLengths())
+        strokeId = toolpath.strokeIndex()
+        cumLen -= cumLen[toolpath.offsets[:-1]][strokeId]
+
+        # Keep a point whenever the length along the stroke
+        # passes another multiple of minSegmentLen
+        bucket = np.floor(cumLen/minSegmentLen, out=cumLen)
+        keep = np.ones((toolpath.numPoints(),), dtype=bool)
+        np.not_equal(bucket[1:], bucket[:-1], out=keep[1:])
+        del bucket, cumLen
+        keep[toolpath.offsets[:-1]] = True
+        keep[toolpath.offsets[1:] - 1] = True
+
+        counts = np.bincount(strokeId[keep], minlength=len(toolpath))
+        toolpath = Toolpath(toolpath.coords[keep], np.concatenate(([0], np.cumsum(counts))),
+                            toolpath.penDown, toolpath.speed, dtype=toolpath.coords.dtype)
+
+        strokes = np.nonzero(~toolpath.penDown |
+                             (toolpath.strokeLengths() >= minSegmentLen))[0]
+        toolpath = toolpath.select(strokes)
+
+    print("Reduced size from %d to %d points in %d strokes. " %
+          (init_size, toolpath.numPoints(), len(toolpath)))
+    # The travel strokes start at the home position, which is not part of the model
+    drawing = toolpath.select(np.nonzero(toolpath.penDown)[0])
+    if drawing.numPoints() > 0:
+        bbMin, bbMax = drawing.boundingBox()
+        print("Model bounding box is (%f, %f) x (%f, %f) mm. " %
+              (bbMin[0], bbMin[1], bbMax[0], bbMax[1]))
+    return toolpath
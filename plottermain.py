@@ -6,25 +6,43 @@ if __name__ == '__main__':
     import imageio
     import argparse
 
-    from plotter.plotter import plotter_hw
-    from plotter.plotter import plotter_sw
+    from plotter.plotter.gpio import gpioDriverAvailable
 
     from plotter import config
     from plotter.utils.calibration import Calibration
     from plotter.utils.math import SimplePhysicsEngine
+    from plotter.utils.toolpath import Toolpath
+    from plotter.utils.gcode import openJob
 
     parser = argparse.ArgumentParser(
         description='VPlotter python implementation.')
-    parser.add_argument('--backend', choices={"hw", "sw"}, default="sw",
-                        help="Which backend should be used? Simulation or hardware plotter?")
+    parser.add_argument('--backend', choices={"hw", "sw", "raster"}, default="sw",
+                        help="Which backend should be used? Simulation, hardware plotter or headless rendering into an image?")
     parser.add_argument('--interactive', action='store_true')
+    parser.add_argument('--gpio-driver', choices={"rpi", "mock"}, default=config.PLOTTER_CONFIG["gpio_driver"],
+                        help="GPIO driver of the hardware plotter. The mock driver runs without hardware and records all outputs.")
+    parser.add_argument('--gpio-record', type=str,
+                        help="Save the outputs recorded by the mock GPIO driver to this file (.npy).")
     parser.add_argument('--non-draw-lines', action='store_true',
                         help="If the software plotter is used, non-drawing moves can be visualized in red.")
     parser.add_argument('--sim-speed', type=float, default=0.0001,
                         help="Pause between processed commands in simulation plotter.")
     parser.add_argument('--sim-plot-interval', type=int, default=1000,
                         help="Plot the current state after every N commands.")
-    parser.add_argument('--runfile', type=str)
+    parser.add_argument('--raster-output', type=str, default="plot.png",
+                        help="Image file written by the raster plotter.")
+    parser.add_argument('--raster-ppmm', type=float, default=4,
+                        help="Resolution of the raster plotter in pixels per mm.")
+    parser.add_argument('--raster-aa', action='store_true',
+                        help="Render anti-aliased lines with the raster plotter.")
+    parser.add_argument('--raster-travel', action='store_true',
+                        help="If the raster plotter is used, non-drawing moves are overlaid in red.")
+    parser.add_argument('--raster-height', type=float, default=700,
+                        help="Height of the area rendered by the raster plotter in milimeters.")
+    parser.add_argument('--runfile', type=str,
+                        help="Gcode file, binary job file (.vpj) or step plan (.vsp, hardware plotter only) to execute.")
+    parser.add_argument('--toolpath', action='store_true',
+                        help="Parse the runfile into a toolpath and send whole strokes to the plotter process.")
     parser.add_argument('--calib', nargs=2, type=float,
                         help="Length of left and right string in milimeters", required=True)
 
@@ -33,15 +51,27 @@ if __name__ == '__main__':
 
     calib_len = np.array(args.calib)
 
+    # Backends are imported on demand, the simulation requires a display
     if args.backend == "hw":
-        if hasattr(plotter_hw, 'HardwarePlotter'):
-            print("Using hardware plotter backend")
+        from plotter.plotter import plotter_hw
+        if gpioDriverAvailable(args.gpio_driver):
+            print("Using hardware plotter backend with %s GPIO driver" %
+                  args.gpio_driver)
             plotter = plotter_hw.HardwarePlotter(
-                config.PLOTTER_CONFIG, calib_len, SimplePhysicsEngine)
+                dict(config.PLOTTER_CONFIG, gpio_driver=args.gpio_driver,
+                     gpio_record_file=args.gpio_record),
+                calib_len, SimplePhysicsEngine)
         else:
-            print("Hardware plotter backend not available!")
+            print("Hardware plotter backend not available! RPi.GPIO not found, use --gpio-driver mock to run without hardware.")
             exit(1)
+    elif args.backend == "raster":
+        from plotter.plotter import plotter_raster
+        print("Using raster plotter backend")
+        plotter = plotter_raster.RasterPlotter(
+            config.PLOTTER_CONFIG, calib_len, SimplePhysicsEngine, args.raster_output, args.raster_ppmm,
+            args.raster_aa, args.raster_travel, args.raster_height)
     else:
+        from plotter.plotter import plotter_sw
         if hasattr(plotter_sw, 'SimulationPlotter'):
             print("Using simulation plotter backend")
             plotter = plotter_sw.SimulationPlotter(
@@ -51,7 +81,7 @@ if __name__ == '__main__':
             exit(1)
 
     print(plotter)
-    plotter.workerQueue.put("G28")
+    plotter.queueItem("G28")
 
     if args.interactive:
         import sys
@@ -59,8 +89,23 @@ if __name__ == '__main__':
         for line in sys.stdin:
             if len(line) == 0:
                 break
-            plotter.workerQueue.put(line)
+            # Execute interactive commands immediately
+            plotter.queueItem(line.strip())
+            plotter.flushQueue()
     elif args.runfile is not None:
-        plotter.executeGCodeFile(args.runfile)
+        isJob = args.runfile.endswith(".vpj")
+        if args.runfile.endswith(".vsp"):
+            if args.backend == "hw":
+                plotter.executeStepPlanFile(args.runfile)
+            else:
+                print("Step plans can only be executed by the hardware plotter.")
+        elif args.toolpath and isJob:
+            plotter.executeToolpath(Toolpath.fromCommands(openJob(args.runfile)))
+        elif args.toolpath:
+            plotter.executeToolpath(Toolpath.fromGCodeFile(args.runfile))
+        elif isJob:
+            plotter.executeJobFile(args.runfile)
+        else:
+            plotter.executeGCodeFile(args.runfile)
 
     plotter.shutdown()
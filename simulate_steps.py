@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+if __name__ == '__main__':
+    import numpy as np
+    import time
+    import imageio
+    import argparse
+
+    from plotter import config
+    from plotter.plotter.plotter_steps import StepSimulator
+    from plotter.utils.math import SimplePhysicsEngine
+    from plotter.utils.raster import rasterizeSegments, composeImage
+
+    parser = argparse.ArgumentParser(
+        description='Simulates the stepper moves of a job on the hardware plotter, including the step quantization and the '
+        'interpolation of the cord lengths, and reports the deviation of the pen from the ideal path.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--input', type=str, required=True, nargs="+",
+                        help="Gcode files or binary job files (.vpj). Multiple files are simulated one after another.")
+    parser.add_argument('--calib', nargs=2, type=float, required=True,
+                        help="Length of left and right string in milimeters.")
+    parser.add_argument('--output', type=str,
+                        help="Render the simulated drawing moves into this image file. Only supported for a single input file.")
+    parser.add_argument('--ppmm', type=float, default=8,
+                        help="Resolution of the rendered image in pixels per mm.")
+    parser.add_argument('--height', type=float, default=700,
+                        help="Height of the rendered area in milimeters.")
+
+    args = parser.parse_args()
+
+    if args.output is not None and len(args.input) > 1:
+        print("Rendering is only supported for a single input file.")
+        exit(1)
+
+    for file_name in args.input:
+        start = time.time()
+        simulator = StepSimulator(config.PLOTTER_CONFIG, np.array(args.calib),
+                                  SimplePhysicsEngine)
+
+        canvas = None
+        if args.output is not None:
+            canvas = np.zeros((int(np.ceil(args.height*args.ppmm)),
+                               int(np.ceil(simulator.calib.base*args.ppmm))), dtype=np.float32)
+            lastPoint = simulator.currPos[None].copy()
+
+            def renderTicks(points, penDown):
+                # Connect the ticks with the last pen position
+                if penDown:
+                    path = np.concatenate((lastPoint, points)) + simulator.calib.origin
+                    rasterizeSegments(canvas, np.stack((path[:-1], path[1:]), axis=1), args.ppmm)
+                lastPoint[:] = points[-1]
+            simulator.onTicks = renderTicks
+
+        if file_name.endswith(".vpj"):
+            simulator.simulateJob(file_name)
+        else:
+            with open(file_name, 'r') as f:
+                simulator.simulateGCode(f)
+        simulator.close()
+
+        print("%s (simulated %d ticks in %.2f s)" % (file_name, simulator.drawDeviation.count +
+                                                       simulator.travelDeviation.count, time.time() - start))
+        print(simulator.deviationReport())
+
+        if canvas is not None:
+            imageio.imwrite(args.output, composeImage(canvas))
+            print("Image saved to %s" % args.output)